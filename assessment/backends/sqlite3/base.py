@@ -0,0 +1,24 @@
+"""
+SQLite tuned for a web app with several concurrent workers.
+
+WAL mode lets readers carry on while a writer commits, and the remaining
+pragmas trade a little durability on power loss (not on crashes) and some
+memory for far fewer fsyncs and disk reads.
+"""
+from django.db.backends.sqlite3 import base
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -65536',  # KiB, i.e. 64MB
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 268435456',
+)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
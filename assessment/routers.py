@@ -0,0 +1,69 @@
+"""
+Database routing between the primary and an optional read replica.
+
+Everything reads from and writes to ``default`` unless a view opts in with
+`read_from_replica`, in which case its reads go to the ``replica`` alias when
+one is configured. Only read-only views which can tolerate replication lag
+should opt in; the admin always uses the primary. Code which caches what it
+reads until the next write, when a lagging replica could hand it data from
+before that write, reads from the primary inside `primary_reads`.
+"""
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+REPLICA = 'replica'
+
+_reading_from_replica = ContextVar('reading_from_replica', default=False)
+
+
+@contextmanager
+def replica_reads():
+    token = _reading_from_replica.set(True)
+    try:
+        yield
+    finally:
+        _reading_from_replica.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    token = _reading_from_replica.set(False)
+    try:
+        yield
+    finally:
+        _reading_from_replica.reset(token)
+
+
+def read_from_replica(view):
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            with replica_reads():
+                return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with replica_reads():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        if _reading_from_replica.get() and REPLICA in settings.DATABASES:
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'companies.middleware.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,12 +76,58 @@ WSGI_APPLICATION = 'assessment.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
 
+# Configured from the environment. Defaults to SQLite in WAL mode (see
+# assessment.backends.sqlite3); set DB_ENGINE etc. for a server database.
+# Setting DB_REPLICA_NAME (and DB_REPLICA_HOST for a server database) adds a
+# read replica which read-only API views use, see assessment.routers. Locally
+# that can be a copy of db.sqlite3, e.g. `sqlite3 db.sqlite3 ".backup replica.sqlite3"`.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'ENGINE': os.environ.get('DB_ENGINE', 'assessment.backends.sqlite3'),
+        'NAME': os.environ.get('DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+        'USER': os.environ.get('DB_USER', ''),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+        'HOST': os.environ.get('DB_HOST', ''),
+        'PORT': os.environ.get('DB_PORT', ''),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
     }
 }
+if DATABASES['default']['ENGINE'] == 'assessment.backends.sqlite3':
+    # Seconds to wait for another writer's lock before giving up
+    DATABASES['default']['OPTIONS'] = {'timeout': 20}
+
+if os.environ.get('DB_REPLICA_NAME'):
+    DATABASES['replica'] = dict(
+        DATABASES['default'],
+        NAME=os.environ['DB_REPLICA_NAME'],
+        HOST=os.environ.get('DB_REPLICA_HOST', DATABASES['default']['HOST']),
+        TEST={'MIRROR': 'default'},
+    )
+
+DATABASE_ROUTERS = ['assessment.routers.ReplicaRouter']
+
+
+# Caches
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'files': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache'),
+    },
+}
+
+# The cache holding API responses and the data version which invalidates them.
+# Use 'files' when running more than one process.
+COMPANIES_CACHE = os.environ.get('COMPANIES_CACHE', 'default')
+
+# How long the change feed holds back changes, to let the transactions which
+# made them commit. Keep it longer than any transaction writing companies.
+COMPANIES_CHANGES_SETTLE_SECONDS = int(os.environ.get('COMPANIES_CHANGES_SETTLE_SECONDS', 5))
 
 
 # Password validation
@@ -120,3 +167,8 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.11/howto/static-files/
 
 STATIC_URL = '/static/'
+STATIC_ROOT = os.environ.get('STATIC_ROOT', os.path.join(BASE_DIR, 'staticfiles'))
+STATICFILES_STORAGE = 'assessment.storage.CompressedManifestStaticFilesStorage'
+
+# Collected files whose names include a content hash are served with this max-age
+STATIC_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
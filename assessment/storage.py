@@ -0,0 +1,46 @@
+"""
+Static files storage for production: hashed names and precompressed copies.
+
+`collectstatic` writes every file under a name containing a hash of its
+contents, which can be cached forever (see `assessment.views.static_view`),
+plus a gzipped copy of each text file for clients which accept it.
+"""
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.json', '.map', '.svg', '.txt')
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super(CompressedManifestStaticFilesStorage, self).stored_name(name)
+        except ValueError:
+            # Not collected, e.g. when running the tests: use the plain name
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        for processed in super(CompressedManifestStaticFilesStorage, self).post_process(
+                paths, dry_run=dry_run, **options):
+            yield processed
+        if dry_run:
+            return
+
+        for name in set(paths) | set(self.hashed_files.values()):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS):
+                self._compress(name)
+
+    def _compress(self, name):
+        with self.open(name) as original:
+            content = original.read()
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        if len(compressed) >= len(content):
+            return
+        compressed_name = name + '.gz'
+        if self.exists(compressed_name):
+            self.delete(compressed_name)
+        self._save(compressed_name, ContentFile(compressed))
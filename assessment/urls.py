@@ -13,12 +13,19 @@ Including another URLconf
     1. Import the include() function: from django.conf.urls import url, include
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
+import re
+
+from django.conf import settings
 from django.conf.urls import include, url
 from django.contrib import admin
 from django.http import HttpResponse
 
+from . import views
+
 urlpatterns = [
     url(r'^$', lambda request: HttpResponse('Hello, World!')),
     url(r'^admin/', admin.site.urls),
+    url(r'^healthz/$', views.health_view, name='health'),
     url(r'^companies/', include(('companies.urls', 'companies'), namespace='companies')),
+    url(r'^{0}(?P<path>.+)$'.format(re.escape(settings.STATIC_URL.lstrip('/'))), views.static_view, name='static'),
 ]
@@ -0,0 +1,54 @@
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.http import JsonResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.static import serve
+
+from companies.cache import accepted_encodings
+
+# The 12 hex digit content hash ManifestStaticFilesStorage puts in names
+_HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.\w+$')
+
+
+def health_view(request):
+    """Check every configured database answers, for load balancer health checks."""
+    databases = {}
+    for alias in connections:
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+            databases[alias] = 'ok'
+        except DatabaseError as e:
+            databases[alias] = str(e)
+
+    healthy = all(status == 'ok' for status in databases.values())
+    return JsonResponse({'databases': databases}, status=200 if healthy else 503)
+
+
+def static_view(request, path):
+    """
+    Serve a collected static file, gzipped if the client accepts it.
+
+    Files with a content hash in their name never change, so are cached for
+    ``STATIC_IMMUTABLE_MAX_AGE``; anything else must be revalidated.
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    compressed = path + '.gz'
+    accepted = accepted_encodings(request)
+    if (('gzip' in accepted or '*' in accepted) and
+            os.path.isfile(os.path.join(settings.STATIC_ROOT, compressed))):
+        # serve() sets the Content-Type of the original and Content-Encoding: gzip
+        response = serve(request, compressed, document_root=settings.STATIC_ROOT)
+    else:
+        response = serve(request, path, document_root=settings.STATIC_ROOT)
+
+    if _HASHED_NAME_RE.search(path):
+        patch_cache_control(response, public=True, max_age=settings.STATIC_IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,97 @@
+"""
+Benchmarks for the companies API and admin hot paths.
+
+Not collected by a plain ``pytest`` run; run them explicitly, e.g.::
+
+    pytest benchmarks/bench_companies.py --bench-scales=1000,100000,1000000
+
+Each endpoint is measured once at a small baseline scale, before any
+benchmark runs, and then at every requested scale, recording wall time,
+query count and peak Python memory. An endpoint whose query count at any
+scale exceeds its baseline fails.
+"""
+import re
+import time
+import tracemalloc
+
+import pytest
+from django.test import Client
+from django.urls import reverse
+
+from companies.cache import get_cache
+
+BASELINE_SCALE = 10
+
+# QueryMetricsMiddleware's count, which includes the queries async views run on other threads
+_SERVER_TIMING_QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+ENDPOINTS = [
+    ('recently_founded', 'companies:recently_founded_companies_api_view', {}),
+    ('company_stats', 'companies:company_stats_api_view', {}),
+    ('top_creators', 'companies:top_creators_api_view', {'by': 'employees', 'k': 10}),
+    ('deal_analytics', 'companies:deal_analytics_api_view', {}),
+    ('admin_changelist_n_employees', 'admin:companies_company_changelist', {'n_employees': 3}),
+]
+
+
+def pytest_generate_tests(metafunc):
+    if 'scale' in metafunc.fixturenames:
+        scales = [int(scale) for scale in metafunc.config.getoption('--bench-scales').split(',')]
+        metafunc.parametrize('scale', sorted(scales))
+
+
+def measure(client, url, params):
+    get_cache().clear()
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        response = client.get(url, params)
+        wall_time = time.perf_counter() - started
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert response.status_code == 200
+    return {
+        'wall_time_ms': round(wall_time * 1000, 3),
+        'queries': int(_SERVER_TIMING_QUERIES_RE.search(response['Server-Timing']).group(1)),
+        'peak_memory_kib': round(peak_memory / 1024, 1),
+    }
+
+
+def _logged_in_client():
+    client = Client()
+    client.login(username='bench', password='bench')
+    return client
+
+
+@pytest.fixture(scope='session')
+def baseline_queries(grow_dataset, django_db_blocker, bench_results):
+    """The query count of each endpoint at `BASELINE_SCALE`, whichever benchmarks are selected."""
+    grow_dataset(BASELINE_SCALE)
+    queries = {}
+    with django_db_blocker.unblock():
+        client = _logged_in_client()
+        for name, url_name, params in ENDPOINTS:
+            result = measure(client, reverse(url_name), params)
+            bench_results.append(dict(result, endpoint=name, scale=BASELINE_SCALE))
+            queries[name] = result['queries']
+    return queries
+
+
+def test_endpoints(scale, grow_dataset, baseline_queries, bench_results, django_db_blocker):
+    grow_dataset(scale)
+
+    grown = []
+    with django_db_blocker.unblock():
+        client = _logged_in_client()
+        for name, url_name, params in ENDPOINTS:
+            result = measure(client, reverse(url_name), params)
+            bench_results.append(dict(result, endpoint=name, scale=scale))
+
+            if result['queries'] > baseline_queries[name]:
+                grown.append('{0}: {1} queries at {2} companies, {3} at {4}'.format(
+                    name, result['queries'], scale, baseline_queries[name], BASELINE_SCALE,
+                ))
+
+    assert not grown, 'Query count grows with the number of companies:\n' + '\n'.join(grown)
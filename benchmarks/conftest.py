@@ -0,0 +1,69 @@
+import json
+import platform
+import subprocess
+
+import pytest
+from django.contrib.auth.models import User
+
+from companies.factories import CountryFactory, UserFactory
+from companies.models import Company
+from companies.rollups import rebuild_company_stats
+from companies.seeding import BulkSeeder
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmarks')
+    group.addoption(
+        '--bench-scales', default='1000',
+        help='Comma separated numbers of companies to benchmark at, e.g. 1000,100000,1000000',
+    )
+    group.addoption('--bench-output', default='bench_results.json', help='Where to write the JSON results')
+    group.addoption('--bench-seed', type=int, default=1, help='Random seed for the benchmark dataset')
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@pytest.fixture(scope='session')
+def bench_results(request):
+    results = []
+    yield results
+    with open(request.config.getoption('--bench-output'), 'w') as output:
+        json.dump({
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'results': results,
+        }, output, indent=2)
+
+
+@pytest.fixture(scope='session')
+def grow_dataset(django_db_setup, django_db_blocker, request):
+    """
+    Returns a function which tops the test database up to `n` companies.
+
+    The data is committed, so each scale only seeds the difference from the
+    one before: the benchmarks use the database through
+    ``django_db_blocker`` rather than the ``django_db`` mark, whose
+    transaction would roll it back after every test.
+    """
+    with django_db_blocker.unblock():
+        User.objects.create_superuser('bench', 'bench@example.com', 'bench')
+        seeder = BulkSeeder(
+            UserFactory.create_batch(10),
+            CountryFactory.create_batch(5),
+            seed=request.config.getoption('--bench-seed'),
+            batch_size=5000,
+        )
+
+    def grow(n):
+        with django_db_blocker.unblock():
+            missing = n - Company.objects.count()
+            if missing > 0:
+                seeder.seed_companies(missing)
+                rebuild_company_stats()
+
+    return grow
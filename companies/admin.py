@@ -2,8 +2,70 @@
 from __future__ import unicode_literals
 
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
 
 from .models import Company, Country, Deal, Employee
+from .search import company_matches
+
+
+def _sqlite_row_estimate(cursor, table):
+    # Each sqlite_stat1 row's stat starts with the number of rows in the table
+    cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+    counts = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+    return max(counts) if counts else None
+
+
+def _postgresql_row_estimate(cursor, table):
+    cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+    row = cursor.fetchone()
+    return int(row[0]) if row and row[0] >= 0 else None
+
+
+_ROW_ESTIMATORS = {
+    'sqlite': _sqlite_row_estimate,
+    'postgresql': _postgresql_row_estimate,
+}
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator which takes the size of an unfiltered changelist from the
+    database's table statistics rather than a ``COUNT(*)`` of the table.
+
+    Statistics are only as fresh as the last ``ANALYZE`` (or autovacuum), so
+    small tables, filtered changelists and tables without statistics are
+    counted exactly.
+    """
+    exact_count_below = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self._estimate(queryset)
+            if estimate is not None and estimate >= self.exact_count_below:
+                return estimate
+        return super(EstimatedCountPaginator, self).count
+
+    def _estimate(self, queryset):
+        connection = connections[queryset.db]
+        estimator = _ROW_ESTIMATORS.get(connection.vendor)
+        if estimator is None:
+            return None
+        try:
+            with connection.cursor() as cursor:
+                return estimator(cursor, queryset.model._meta.db_table)
+        except DatabaseError:
+            # e.g. SQLite has no sqlite_stat1 until the first ANALYZE
+            return None
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Don't count the whole table again to show "N of M selected" when filtering
+    show_full_result_count = False
 
 
 class EmployeeCountListFilter(admin.SimpleListFilter):
@@ -19,23 +81,67 @@ class EmployeeCountListFilter(admin.SimpleListFilter):
         )
 
     def queryset(self, request, queryset):
-        # NOTE: this runs really slow in production once we've got a full DB
-        if not self.value():
-            pks = queryset.values_list('pk', flat=True)
-        else:
-            pks = []
-            for company in queryset:
-                if company.employee_set.count() >= int(self.value()):
-                    pks.append(company.pk)
-
-        return queryset.filter(pk__in=pks)
+        # Company.employee_count is denormalised and indexed, so this is a
+        # range scan rather than a count per company
+        if self.value():
+            return queryset.filter(employee_count__gte=int(self.value()))
+        return queryset
 
 
 @admin.register(Company)
-class CompanyAdmin(admin.ModelAdmin):
+class CompanyAdmin(LargeTableAdmin):
+    list_display = ('name', 'country', 'date_founded', 'employee_count')
     list_filter = ('date_founded', EmployeeCountListFilter,)
+    list_select_related = ('country',)
+    raw_id_fields = ('creator', 'monitors')
+    # Names and descriptions are searched through the full text index below
+    search_fields = ('companies_house_id__exact',)
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            obj.save(update_fields=Company.saved_fields())
+        else:
+            obj.save()
+
+    def get_ordering(self, request):
+        # Filtered on employee_count, list the biggest first: the changelist's
+        # usual order by id would walk the whole table past the small companies
+        if request.GET.get(EmployeeCountListFilter.parameter_name):
+            return ('-employee_count',)
+        return super().get_ordering(request)
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Companies matching `search_fields`, or whose name or description
+        matches the search term (see `companies.search`).
+
+        Both halves use an index, where ``icontains`` on the description
+        would scan the table. This also backs the company autocomplete of the
+        Deal and Employee admins.
+        """
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        term = search_term.strip()
+        if not term:
+            return results, may_have_duplicates
+        matches = company_matches(term)
+        if matches is not None:
+            results |= queryset.filter(pk__in=matches)
+        return results, may_have_duplicates
+
+
+@admin.register(Deal)
+class DealAdmin(LargeTableAdmin):
+    list_display = ('company', 'date_of_deal', 'amount_raised')
+    list_select_related = ('company',)
+    autocomplete_fields = ('company',)
+
+
+@admin.register(Employee)
+class EmployeeAdmin(LargeTableAdmin):
+    list_display = ('name', 'job_title', 'company', 'email')
+    list_select_related = ('company',)
+    autocomplete_fields = ('company',)
+    search_fields = ('=email',)
 
 
 admin.site.register(Country)
-admin.site.register(Deal)
-admin.site.register(Employee)
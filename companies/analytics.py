@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Deal analytics: distributions of ``Deal.amount_raised`` by country and by
+quarter, rolling four quarter totals and per-company growth.
+
+The deals' columns are read in one query and every statistic is computed
+on NumPy arrays, grouping by sorting rather than looping over deals in
+Python. The API caches the result under the data version like the other
+stats (see `companies.cache`).
+"""
+from __future__ import unicode_literals
+
+import numpy as np
+from django.db.models import F
+
+from .models import Company, Country, Deal
+from .stats import last_quarters
+
+PERCENTILES = (25, 50, 75, 90)
+TOP_GROWTH = 10
+
+
+def deal_columns():
+    """The id, company id, country id, date and amount raised of every deal, as arrays."""
+    rows = list(
+        Deal.objects
+        .order_by()
+        .values_list('id', 'company_id', F('company__country_id'), 'date_of_deal', 'amount_raised')
+    )
+    if not rows:
+        return (
+            np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+            np.empty(0, dtype='datetime64[D]'), np.empty(0, dtype=np.float64),
+        )
+    deal, company, country, date, amount = zip(*rows)
+    return (
+        np.fromiter(deal, dtype=np.int64, count=len(rows)),
+        np.fromiter(company, dtype=np.int64, count=len(rows)),
+        np.fromiter(country, dtype=np.int64, count=len(rows)),
+        np.array(date, dtype='datetime64[D]'),
+        np.fromiter(amount, dtype=np.float64, count=len(rows)),
+    )
+
+
+def quarter_index(dates):
+    """Quarters since 1970 of an array of dates, in the numbering `quarter_of` gives (year * 4 + quarter - 1)."""
+    return dates.astype('datetime64[M]').astype(np.int64) // 3 + 1970 * 4
+
+
+def _groups(keys):
+    """Where each run of equal, sorted `keys` starts, and how long it is."""
+    return np.unique(keys, return_index=True, return_counts=True)
+
+
+def grouped_percentiles(values, starts, counts, q):
+    """
+    The `q`-th percentile of each group of `values`, sorted within groups,
+    given by `starts` and `counts`.
+
+    Interpolates linearly between the closest ranks, as ``np.percentile``
+    does, for all the groups at once.
+    """
+    position = starts + (counts - 1) * (q / 100.0)
+    below = np.floor(position).astype(np.int64)
+    above = np.ceil(position).astype(np.int64)
+    return values[below] + (values[above] - values[below]) * (position - below)
+
+
+def _distributions(keys, amounts):
+    """Count, total, mean and percentiles of `amounts` for each of the distinct `keys`."""
+    order = np.lexsort((amounts, keys))
+    keys, amounts = keys[order], amounts[order]
+    groups, starts, counts = _groups(keys)
+    totals = np.add.reduceat(amounts, starts) if len(amounts) else np.empty(0)
+    distributions = {
+        'deal_count': counts,
+        'amount_raised_total': totals,
+        'average_amount_raised': totals / np.maximum(counts, 1),
+    }
+    for q in PERCENTILES:
+        distributions['p{0}'.format(q)] = grouped_percentiles(amounts, starts, counts, q)
+    return groups, distributions
+
+
+def _rows(distributions, n):
+    return [
+        {name: (None if np.isnan(values[i]) else values[i].item()) for name, values in distributions.items()}
+        for i in range(n)
+    ]
+
+
+def by_country(country, amount):
+    codes = dict(Country.objects.values_list('id', 'iso_code'))
+    groups, distributions = _distributions(country, amount)
+    rows = _rows(distributions, len(groups))
+    for row, country_id in zip(rows, groups.tolist()):
+        row['country'] = codes[country_id]
+    return sorted(rows, key=lambda row: row['country'])
+
+
+def by_quarter(quarter, amount, years=5, today=None):
+    """
+    The distribution of the deals of each quarter of the last `years` years,
+    with the total raised over that quarter and the three before it.
+
+    Quarters with no deals have a count and total of zero, and no average
+    or percentiles.
+    """
+    quarters = last_quarters(years * 4, today=today)
+    first = quarters[0][0] * 4 + quarters[0][1] - 1
+    # The rolling total of the first quarter reaches back three more
+    start, end = first - 3, first + len(quarters)
+
+    in_range = (quarter >= start) & (quarter < end)
+    offsets = quarter[in_range] - start
+    totals = np.bincount(offsets, weights=amount[in_range], minlength=end - start)
+    rolling = np.convolve(totals, np.ones(4), mode='valid')
+
+    groups, distributions = _distributions(offsets, amount[in_range])
+    filled = {}
+    for name, values in distributions.items():
+        # No deals means nothing raised, but no average or percentiles
+        empty = 0 if name in ('deal_count', 'amount_raised_total') else np.nan
+        filled[name] = np.full(end - start, empty, dtype=np.float64)
+        filled[name][groups] = values
+
+    rows = _rows(filled, end - start)[3:]
+    for row, (year, q), total in zip(rows, quarters, rolling.tolist()):
+        row.update(year=year, quarter=q, rolling_4_quarter_total=total)
+        row['deal_count'] = int(row['deal_count'])
+    return rows
+
+
+def company_growth(deal, company, date, amount, top=TOP_GROWTH):
+    """
+    How much more (or less) each company raised in its latest deal than in
+    the one before, as a fraction of the earlier amount. Deals on the same
+    day are taken in the order of their ids, as the company details list them.
+
+    Only companies with at least two deals, the earlier of which raised
+    something, have a growth. Returns its distribution and the companies
+    which grew the most.
+    """
+    order = np.lexsort((deal, date, company))
+    company, amount = company[order], amount[order]
+    companies, starts, counts = _groups(company)
+
+    repeat = counts >= 2
+    latest = (starts + counts - 1)[repeat]
+    previous = amount[latest - 1]
+    valid = previous > 0
+    companies = companies[repeat][valid]
+    growth = amount[latest][valid] / previous[valid] - 1
+
+    summary = {'company_count': len(growth)}
+    for q in PERCENTILES:
+        summary['p{0}'.format(q)] = np.percentile(growth, q).item() if len(growth) else None
+
+    best = np.argsort(-growth, kind='stable')[:top]
+    names = dict(Company.objects.filter(pk__in=companies[best].tolist()).values_list('id', 'name'))
+    summary['top'] = [
+        {'id': company_id, 'name': names[company_id], 'growth': value}
+        for company_id, value in zip(companies[best].tolist(), growth[best].tolist())
+    ]
+    return summary
+
+
+def deal_analytics(years=5, today=None):
+    deal, company, country, date, amount = deal_columns()
+    return {
+        'by_country': by_country(country, amount),
+        'by_quarter': by_quarter(quarter_index(date), amount, years=years, today=today),
+        'company_growth': company_growth(deal, company, date, amount),
+    }
@@ -6,3 +6,11 @@ from django.apps import AppConfig
 
 class CompaniesConfig(AppConfig):
     name = 'companies'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401
+        from .middleware import install_query_recorder
+
+        connection_created.connect(install_query_recorder)
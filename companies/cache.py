@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Versioned response caching for the public API.
+
+Every cached response is keyed on a data version which `companies.signals`
+bumps whenever a Company, Country, Deal or Employee changes, or a user is
+renamed, so stale entries are simply never read again and expire on their
+own. The version is a millisecond timestamp, which doubles as the responses'
+``Last-Modified``. Responses which also depend on today's date, like the
+per-quarter stats, add it to their variant and pass the day (or quarter)
+they're current from as `since`, which ``Last-Modified`` is never before.
+
+Each entry holds the compact JSON body along with its gzip and, when the
+``brotli`` package is installed, brotli compressions, so a cached response
+is written out as is in whichever encoding the client accepts. ``orjson`` is
+used to encode the JSON when it's installed.
+
+The cache alias is configured by ``settings.COMPANIES_CACHE``. The version
+lives in the same cache, so running several processes needs a shared backend
+(e.g. the file-based one) for writes in one to invalidate the others.
+"""
+from __future__ import unicode_literals
+
+import gzip
+import hashlib
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from assessment.routers import primary_reads
+from . import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DATA_VERSION_KEY = 'companies:data-version'
+RESPONSE_TIMEOUT = 60 * 60 * 24
+
+
+def get_cache():
+    return caches[settings.COMPANIES_CACHE]
+
+
+def bump_data_version():
+    cache = get_cache()
+    version = max(int(time.time() * 1000), (cache.get(DATA_VERSION_KEY) or 0) + 1)
+    cache.set(DATA_VERSION_KEY, version, timeout=None)
+    return version
+
+
+def data_version():
+    version = get_cache().get(DATA_VERSION_KEY)
+    if version is None:
+        version = bump_data_version()
+    return version
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data, default=DjangoJSONEncoder().default)
+    return json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')
+
+
+COMPRESSORS = {
+    'gzip': lambda body: gzip.compress(body, compresslevel=9, mtime=0),
+}
+if brotli is not None:
+    COMPRESSORS['br'] = lambda body: brotli.compress(body, mode=brotli.MODE_TEXT)
+
+# In order of preference
+CONTENT_ENCODINGS = ('br', 'gzip')
+
+
+def _render(data):
+    """The cache entry for `data`: its JSON body in every encoding that makes it smaller."""
+    body = dumps(data)
+    encodings = {'identity': body}
+    for encoding, compress in COMPRESSORS.items():
+        compressed = compress(body)
+        if len(compressed) < len(body):
+            encodings[encoding] = compressed
+    return {'encodings': encodings, 'etag': hashlib.sha1(body).hexdigest()}
+
+
+def accepted_encodings(request):
+    """The content codings the request's ``Accept-Encoding`` allows, lowercased, without those given ``q=0``."""
+    accepted = set()
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = coding.partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def _negotiate(request, entry):
+    accepted = accepted_encodings(request)
+    for encoding in CONTENT_ENCODINGS:
+        if encoding in entry['encodings'] and (encoding in accepted or '*' in accepted):
+            return encoding
+    return 'identity'
+
+
+def _response_key(name, variant=None):
+    version = data_version()
+    return 'companies:response:{0}:{1}:{2}'.format(name, variant or '', version), version
+
+
+def _respond(request, name, entry, version, since=None):
+    encoding = _negotiate(request, entry)
+    # Each encoding is a different representation, so needs its own strong ETag
+    etag = '"{0}"'.format(entry['etag'] if encoding == 'identity' else '{0}-{1}'.format(entry['etag'], encoding))
+    last_modified = version // 1000
+    if since is not None:
+        # The start of the day, in local time like date.today()
+        last_modified = max(last_modified, int(time.mktime(since.timetuple())))
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        body = entry['encodings'][encoding]
+        response = HttpResponse(body, content_type='application/json')
+        response['Content-Length'] = len(body)
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+    else:
+        metrics.increment('companies_response_not_modified_total', labels={'endpoint': name})
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, public=True, no_cache=True)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def _cached_entry(name, build, variant=None):
+    cache = get_cache()
+    key, version = _response_key(name, variant)
+
+    entry = cache.get(key)
+    labels = {'endpoint': name}
+    if entry is None:
+        metrics.increment('companies_response_cache_misses_total', labels=labels)
+        with primary_reads():
+            entry = _render(build())
+        cache.set(key, entry, timeout=RESPONSE_TIMEOUT)
+    else:
+        metrics.increment('companies_response_cache_hits_total', labels=labels)
+    return entry, version
+
+
+def cached_json_response(request, name, build, variant=None, since=None):
+    """
+    Respond with the JSON encoding of `build()`, cached under the current data version.
+
+    `variant` distinguishes the responses of one endpoint `name`, e.g. for
+    different query parameters. Sends a strong ``ETag`` and
+    ``Last-Modified``, and answers conditional requests which match them
+    with a 304 without calling `build` or touching the database. A response
+    which also changes with the date passes the date its `variant` is current
+    from as `since`, so that ``Last-Modified`` isn't earlier.
+
+    `build` reads from the primary even in a `read_from_replica` view: the
+    version is bumped as soon as a write commits, and an entry built from a
+    replica which hasn't caught up yet would be served until the next one.
+    """
+    entry, version = _cached_entry(name, build, variant)
+    return _respond(request, name, entry, version, since)
+
+
+def cached_json(name, build, variant=None):
+    """The decoded body `cached_json_response` responds with, for pages which render the same data."""
+    entry, _ = _cached_entry(name, build, variant)
+    return json.loads(entry['encodings']['identity'])
+
+
+async def acached_json_response(request, name, build, variant=None, since=None):
+    """`cached_json_response` for async views, where `build` is a coroutine function."""
+    cache = get_cache()
+    key, version = await sync_to_async(_response_key)(name, variant)
+
+    entry = await sync_to_async(cache.get)(key)
+    labels = {'endpoint': name}
+    if entry is None:
+        metrics.increment('companies_response_cache_misses_total', labels=labels)
+        with primary_reads():
+            entry = _render(await build())
+        await sync_to_async(cache.set)(key, entry, timeout=RESPONSE_TIMEOUT)
+    else:
+        metrics.increment('companies_response_cache_hits_total', labels=labels)
+    return _respond(request, name, entry, version, since)
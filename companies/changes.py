@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+A feed of the companies, deals and employees changed since a cursor.
+
+Saved rows are read from each table's ``(modified, id)`` index and deleted
+ones from `Tombstone`, and merged in ``(modified, source, id)`` order, so a
+page costs one indexed query per source whatever the size of the tables.
+
+Changes made in the last ``settings.COMPANIES_CHANGES_SETTLE_SECONDS`` are
+held back: a transaction still in flight may commit rows whose ``modified``
+is earlier than ones already served, and the cursor would have moved past
+them. Rows changed without ``save()``, e.g. by ``QuerySet.update()``, keep
+their old ``modified`` and so aren't in the feed; that's why
+``Company.employee_count``, which only changes that way, isn't either.
+"""
+from __future__ import unicode_literals
+
+import base64
+import datetime
+import heapq
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .exports import EXPORTS
+from .models import Company, Deal, Employee, Tombstone
+
+RESOURCES = {
+    Company: 'companies',
+    Deal: 'deals',
+    Employee: 'employees',
+}
+
+# The order sources are merged in for rows with the same timestamp
+SOURCES = ('companies', 'deals', 'employees', 'deletions')
+
+
+def encode_cursor(modified, source, pk):
+    value = json.dumps([modified.isoformat(), SOURCES.index(source), pk])
+    return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+
+
+def parse_cursor(cursor):
+    """Parse an `encode_cursor` cursor into ``(modified, source index, id)``, or raise ValueError."""
+    try:
+        modified, rank, pk = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        modified = datetime.datetime.fromisoformat(modified)
+    except (TypeError, UnicodeError, ValueError) as e:
+        raise ValueError('Invalid cursor: {0}'.format(e))
+    if not (isinstance(rank, int) and isinstance(pk, int) and 0 <= rank < len(SOURCES)):
+        raise ValueError('Invalid cursor: {0}'.format(cursor))
+    return modified, rank, pk
+
+
+def _after(field, cursor, rank):
+    """Rows of source `rank` which come after `cursor` in feed order."""
+    if cursor is None:
+        return Q()
+    modified, cursor_rank, pk = cursor
+    if rank > cursor_rank:
+        return Q(**{field + '__gte': modified})
+    if rank < cursor_rank:
+        return Q(**{field + '__gt': modified})
+    return Q(**{field + '__gt': modified}) | Q(**{field: modified, 'id__gt': pk})
+
+
+def _saved(resource, cursor, until, limit):
+    rank = SOURCES.index(resource)
+    fields = EXPORTS[resource].fields
+    rows = (
+        EXPORTS[resource].model.objects
+        .filter(_after('modified', cursor, rank), modified__lte=until)
+        .order_by('modified', 'id')
+        .values_list('modified', *fields)[:limit]
+    )
+    for row in rows:
+        data = dict(zip(fields, row[1:]))
+        change = {'resource': resource, 'op': 'upsert', 'id': data['id'], 'modified': row[0], 'data': data}
+        yield (row[0], rank, data['id']), change
+
+
+def _deleted(cursor, until, limit):
+    rank = SOURCES.index('deletions')
+    rows = (
+        Tombstone.objects
+        .filter(_after('deleted', cursor, rank), deleted__lte=until)
+        .order_by('deleted', 'id')
+        .values_list('deleted', 'id', 'resource', 'object_id')[:limit]
+    )
+    for deleted, pk, resource, object_id in rows:
+        yield (deleted, rank, pk), {'resource': resource, 'op': 'delete', 'id': object_id, 'modified': deleted}
+
+
+def changes(since=None, limit=100):
+    """
+    The next `limit` changes after the cursor `since`, or from the start.
+
+    Returns ``(changes, cursor)``. Each change is a dict of the
+    ``resource``, the ``op`` (``upsert`` or ``delete``), the ``id`` and
+    ``modified`` time of the row, and for upserts its ``data``. `cursor`
+    resumes after the last change, and is `since` again if there were none.
+    """
+    cursor = parse_cursor(since) if since else None
+    until = timezone.now() - datetime.timedelta(seconds=settings.COMPANIES_CHANGES_SETTLE_SECONDS)
+    sources = [_saved(resource, cursor, until, limit) for resource in EXPORTS]
+    sources.append(_deleted(cursor, until, limit))
+
+    page, position = [], None
+    for position, change in heapq.merge(*sources, key=lambda item: item[0]):
+        page.append(change)
+        if len(page) == limit:
+            break
+    if position is None:
+        return page, since
+    modified, rank, pk = position
+    return page, encode_cursor(modified, SOURCES[rank], pk)
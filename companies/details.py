@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Company details for the API: a company with its country, creator and
+monitors, and the first page of its deals and employees.
+
+However many companies are asked for, their details take one query for the
+companies and one per child list, the deals and employees being limited to
+each company's first page in the database. Later pages are read with
+`child_page`, keyset paginated on the child list's ordering.
+
+Each company's JSON is cached under the data version (see
+`companies.cache`), so it's rebuilt after any write, whether through the
+models' signals or a bulk command which bumps the version itself. Cached
+details are built from the primary, never a lagging replica.
+"""
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db.models import F, Prefetch, Q, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+
+from assessment.routers import primary_reads
+from .cache import RESPONSE_TIMEOUT, data_version, dumps, get_cache
+from .models import Company, Deal, Employee
+
+CHILD_PAGE_SIZE = 20
+
+Children = namedtuple('Children', ('model', 'ordering', 'fields'))
+
+CHILDREN = {
+    # Newest first, along the (company, date_of_deal) index
+    'deals': Children(Deal, ('-date_of_deal', '-id'), ('id', 'date_of_deal', 'amount_raised')),
+    # Contact details are left to the staff only export
+    'employees': Children(Employee, ('id',), ('id', 'name', 'job_title')),
+}
+
+COMPANY_FIELDS = (
+    'id', 'companies_house_id', 'name', 'description', 'date_founded', 'employee_count',
+    'country__iso_code', 'creator__username',
+)
+
+
+def _key(company_id, version):
+    return 'companies:company:{0}:{1}'.format(company_id, version)
+
+
+def _order_by(ordering):
+    return [F(name[1:]).desc() if name.startswith('-') else F(name).asc() for name in ordering]
+
+
+def child_cursor(children, row):
+    return ','.join(str(row[name.lstrip('-')]) for name in children.ordering)
+
+
+def parse_child_cursor(children, cursor):
+    """Parse a `child_cursor` into the values of `children.ordering`, or raise ValueError."""
+    values = cursor.split(',')
+    if len(values) != len(children.ordering):
+        raise ValueError('Invalid cursor: {0}'.format(cursor))
+    try:
+        return [
+            children.model._meta.get_field(name.lstrip('-')).to_python(value)
+            for name, value in zip(children.ordering, values)
+        ]
+    except ValidationError as e:
+        raise ValueError('Invalid cursor: {0}'.format(e))
+
+
+def _after(ordering, values):
+    """Rows which come after `values` in `ordering`."""
+    after, equal = Q(), {}
+    for name, value in zip(ordering, values):
+        field = name.lstrip('-')
+        after |= Q(**dict(equal, **{field + ('__lt' if name.startswith('-') else '__gt'): value}))
+        equal[field] = value
+    return after
+
+
+def _first_pages(children, company_ids, limit):
+    """
+    The ids of the first `limit` children of each of `company_ids`.
+
+    Rows are numbered per company by a window function in a subquery, since
+    a ``Prefetch`` can't be sliced per company.
+    """
+    numbered = (
+        children.model.objects
+        .filter(company_id__in=company_ids)
+        .annotate(position=Window(RowNumber(), partition_by=[F('company_id')], order_by=_order_by(children.ordering)))
+        .order_by()
+        .values('id', 'position')
+    )
+    sql, params = numbered.query.sql_with_params()
+    return RawSQL('SELECT id FROM ({0}) numbered WHERE position <= %s'.format(sql), params + (limit,))
+
+
+def _prefetch_first_page(name, company_ids):
+    children = CHILDREN[name]
+    # One more than a page, to tell whether there's another
+    queryset = (
+        children.model.objects
+        .filter(pk__in=_first_pages(children, company_ids, CHILD_PAGE_SIZE + 1))
+        .only('company', *children.fields)
+        .order_by(*children.ordering)
+    )
+    return Prefetch(children.model._meta.model_name + '_set', queryset=queryset, to_attr='first_' + name)
+
+
+def _page(children, rows, limit):
+    return {
+        'results': rows[:limit],
+        'next': child_cursor(children, rows[limit - 1]) if len(rows) > limit else None,
+    }
+
+
+def _details(company):
+    details = {field: getattr(company, field) for field in COMPANY_FIELDS if '__' not in field}
+    details.update(
+        country=company.country.iso_code,
+        creator=company.creator.username if company.creator else None,
+        monitors=[user.username for user in company.monitors.all()],
+    )
+    for name, children in CHILDREN.items():
+        rows = [
+            {field: getattr(child, field) for field in children.fields}
+            for child in getattr(company, 'first_' + name)
+        ]
+        details[name] = _page(children, rows, CHILD_PAGE_SIZE)
+    return details
+
+
+def _load(company_ids):
+    companies = (
+        Company.objects
+        .filter(pk__in=company_ids)
+        .select_related('country', 'creator')
+        # Company.tracker needs its tracked fields loaded
+        .only(*COMPANY_FIELDS + ('country', 'creator'))
+        .prefetch_related(
+            _prefetch_first_page('deals', company_ids),
+            _prefetch_first_page('employees', company_ids),
+            Prefetch('monitors', queryset=get_user_model().objects.only('id', 'username').order_by('username')),
+        )
+    )
+    return {company.pk: dumps(_details(company)) for company in companies}
+
+
+def company_details(company_ids):
+    """
+    The JSON encoded details of each of `company_ids` which exists, by id.
+
+    Details cached under the current data version are reused, and the rest
+    loaded from the primary in a fixed number of queries, then cached.
+    """
+    cache = get_cache()
+    version = data_version()
+    keys = {company_id: _key(company_id, version) for company_id in company_ids}
+    cached = cache.get_many(list(keys.values()))
+    found = {company_id: cached[key] for company_id, key in keys.items() if key in cached}
+
+    missing = [company_id for company_id in company_ids if company_id not in found]
+    if missing:
+        with primary_reads():
+            loaded = _load(missing)
+        cache.set_many({keys[company_id]: body for company_id, body in loaded.items()}, timeout=RESPONSE_TIMEOUT)
+        found.update(loaded)
+    return found
+
+
+def child_page(company_id, name, after=None, limit=CHILD_PAGE_SIZE):
+    """A page of the company's deals or employees (`name`), starting after the `parse_child_cursor` cursor `after`."""
+    children = CHILDREN[name]
+    queryset = children.model.objects.filter(company_id=company_id).order_by(*children.ordering)
+    if after is not None:
+        queryset = queryset.filter(_after(children.ordering, after))
+    return _page(children, list(queryset.values(*children.fields)[:limit + 1]), limit)
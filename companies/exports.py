@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming exports of companies, deals and employees.
+
+Rows are read with `values_list().iterator()` and encoded as they arrive, so
+memory use doesn't depend on the size of the table and the first bytes are
+ready as soon as the first chunk of rows is.
+"""
+from __future__ import unicode_literals
+
+import csv
+import zlib
+from collections import namedtuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Company, Deal, Employee
+
+Export = namedtuple('Export', ['model', 'fields', 'date_field', 'country_field'])
+
+EXPORTS = {
+    'companies': Export(
+        Company,
+        ('id', 'companies_house_id', 'name', 'description', 'date_founded', 'country__iso_code',
+         'creator__username'),
+        'date_founded',
+        'country__iso_code',
+    ),
+    'deals': Export(
+        Deal,
+        ('id', 'company_id', 'date_of_deal', 'amount_raised'),
+        'date_of_deal',
+        'company__country__iso_code',
+    ),
+    'employees': Export(
+        Employee,
+        ('id', 'company_id', 'name', 'job_title', 'gender', 'email', 'phone_number'),
+        'created__date',
+        'company__country__iso_code',
+    ),
+}
+FORMATS = ('ndjson', 'csv')
+
+# Bytes to gather before handing a chunk on, so we don't write per row
+BUFFER_SIZE = 64 * 1024
+
+
+def export_rows(resource, since=None, until=None, country=None, chunk_size=2000):
+    """The field names and an iterator over the rows of `resource`, optionally filtered."""
+    export = EXPORTS[resource]
+    queryset = export.model.objects.all()
+    # Pin the database now: the rows are read after the view, and any
+    # replica routing it set up, have returned
+    queryset = queryset.using(queryset.db)
+    if since:
+        queryset = queryset.filter(**{export.date_field + '__gte': since})
+    if until:
+        queryset = queryset.filter(**{export.date_field + '__lte': until})
+    if country:
+        queryset = queryset.filter(**{export.country_field: country})
+    rows = queryset.order_by('pk').values_list(*export.fields).iterator(chunk_size=chunk_size)
+    return export.fields, rows
+
+
+def _buffered(pieces):
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= BUFFER_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _ndjson_lines(fields, rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield (encoder.encode(dict(zip(fields, row))) + '\n').encode('utf-8')
+
+
+class _Line(object):
+    """A file-like object for `csv.writer` which just hands back what's written."""
+    def write(self, value):
+        return value
+
+
+def _csv_lines(fields, rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(fields).encode('utf-8')
+    for row in rows:
+        yield writer.writerow(row).encode('utf-8')
+
+
+def render(fields, rows, output_format):
+    lines = _ndjson_lines(fields, rows) if output_format == 'ndjson' else _csv_lines(fields, rows)
+    return _buffered(lines)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -8,6 +8,7 @@ from .models import Company, Country, Deal, Employee
 class UserFactory(factory.django.DjangoModelFactory):
     class Meta:
         model = settings.AUTH_USER_MODEL
+        django_get_or_create = ('username',)
 
     username = factory.Sequence(lambda n: 'user{}'.format(n))
     email = email = factory.LazyAttribute(
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk loading of companies from fixtures and external feeds.
+
+`read_records` streams records out of a Django fixture (as produced by
+``dumpdata``), a JSON array or NDJSON file of flat company records, or a CSV
+of flat company records, without ever parsing the whole file. `Importer`
+writes them in chunks, one transaction per chunk:
+
+* countries are upserted on ``iso_code`` through an in-memory cache,
+* companies are upserted on ``companies_house_id``, or for those without
+  one (like the fixture's) on their name, country and founding date, with
+  one `bulk_update` and one `bulk_create` per chunk,
+* users, employees and monitors from fixtures are bulk inserted, skipping
+  any already there,
+* deals are inserted unless the company already has as many deals of the
+  same date and amount, so importing a file twice doesn't double them.
+
+Records whose company or user isn't in the import are skipped and listed in
+`Importer.unmapped`.
+
+After every chunk the importer can write a checkpoint, from which an
+interrupted import resumes. Bulk writes skip model signals, so the command
+rebuilds the derived stats once it's done.
+"""
+from __future__ import unicode_literals
+
+import csv
+import datetime
+import io
+import json
+import os
+import time
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Company, Country, Deal, Employee
+
+COMPANY_FIELDS = ('name', 'description', 'date_founded', 'country', 'creator')
+USER_FIELDS = ('email', 'password', 'first_name', 'last_name', 'is_staff', 'is_active', 'is_superuser')
+READ_SIZE = 64 * 1024
+
+
+def _iter_json_array(stream):
+    """Yield the elements of the JSON array in `stream` one at a time."""
+    decoder = json.JSONDecoder()
+    buffer = stream.read(READ_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('Expected a JSON array')
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            element, end = decoder.raw_decode(buffer)
+        except ValueError:
+            more = stream.read(READ_SIZE)
+            if not more:
+                raise
+            buffer += more
+            continue
+        yield element
+        buffer = buffer[end:]
+
+
+def _first_character(stream):
+    while True:
+        character = stream.read(1)
+        if not character or not character.isspace():
+            return character
+
+
+def _as_record(data):
+    if 'model' in data:
+        return data['model'], data.get('pk'), data['fields']
+    return 'companies.company', None, data
+
+
+def read_records(path):
+    """Yield ``(model label, pk, fields)`` for each record in the file at `path`."""
+    with io.open(path, encoding='utf-8', newline='') as stream:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(stream):
+                yield _as_record(row)
+            return
+
+        is_array = _first_character(stream) == '['
+        stream.seek(0)
+        if is_array:
+            for element in _iter_json_array(stream):
+                yield _as_record(element)
+        else:
+            for line in stream:
+                if line.strip():
+                    yield _as_record(json.loads(line))
+
+
+def _date(value):
+    return datetime.date.fromisoformat(value) if value else None
+
+
+def company_key(company):
+    """What identifies an imported company: its Companies House id, or without one its name, country and founding."""
+    return company.companies_house_id or (company.name, company.country_id, company.date_founded)
+
+
+def existing_companies(companies):
+    """The companies in the database which may have the `company_key` of one of `companies`."""
+    house_ids = {company.companies_house_id for company in companies if company.companies_house_id}
+    names = {company.name for company in companies if not company.companies_house_id}
+    return Company.objects.filter(Q(companies_house_id__in=house_ids) | Q(companies_house_id='', name__in=names))
+
+
+def company_ids(companies):
+    """The id of the company in the database with the `company_key` of each of `companies`, by key."""
+    rows = (
+        existing_companies(companies)
+        # The oldest of any duplicates
+        .order_by('-id')
+        .values_list('id', 'companies_house_id', 'name', 'country_id', 'date_founded')
+    )
+    ids = {house_id or (name, country_id, date_founded): pk for pk, house_id, name, country_id, date_founded in rows}
+    return {key: ids[key] for key in map(company_key, companies) if key in ids}
+
+
+class Importer(object):
+    def __init__(self, batch_size=1000, checkpoint_path=None, report=None):
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.report = report
+        self.records_done = 0
+        # Fixture primary keys to the ids they were loaded as, per model
+        self.pk_maps = {'auth.user': {}, 'companies.country': {}, 'companies.company': {}}
+        self.country_ids = dict(Country.objects.values_list('iso_code', 'id'))
+        self._pending_model, self._pending = None, []
+        # (model label, fixture pk, missing field) of each record skipped
+        self.unmapped = []
+
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint:
+                state = json.load(checkpoint)
+            self.records_done, self.pk_maps = state['records_done'], state['pk_maps']
+
+    def run(self, records):
+        started, resumed_from = time.monotonic(), self.records_done
+        for index, record in enumerate(records):
+            if index < resumed_from:
+                continue
+            model, pk, fields = record
+            if model != self._pending_model or len(self._pending) >= self.batch_size:
+                self.flush(started, resumed_from)
+                self._pending_model = model
+            self._pending.append((pk, fields))
+        self.flush(started, resumed_from)
+
+    def flush(self, started, resumed_from):
+        if not self._pending:
+            return
+        loader = self.LOADERS.get(self._pending_model)
+        if loader is None:
+            raise ValueError('Cannot import {0} records'.format(self._pending_model))
+        with transaction.atomic():
+            loader(self, self._pending)
+        self.records_done += len(self._pending)
+        self._pending = []
+
+        if self.checkpoint_path:
+            self._write_checkpoint()
+        if self.report:
+            elapsed = time.monotonic() - started
+            self.report(self.records_done, (self.records_done - resumed_from) / elapsed if elapsed else 0)
+
+    def _write_checkpoint(self):
+        partial = self.checkpoint_path + '.tmp'
+        with open(partial, 'w') as checkpoint:
+            json.dump({'records_done': self.records_done, 'pk_maps': self.pk_maps}, checkpoint)
+        os.replace(partial, self.checkpoint_path)
+
+    def _map(self, model, pk):
+        if pk is None:
+            return None
+        return self.pk_maps[model].get(str(pk))
+
+    def _mapped(self, label, records, field, model):
+        """The records whose `field` maps to an imported `model`, with the id it maps to."""
+        for pk, fields in records:
+            mapped = self._map(model, fields[field])
+            if mapped is None:
+                self.unmapped.append((label, pk, field))
+            else:
+                yield mapped, fields
+
+    def _load_users(self, records):
+        User = get_user_model()
+        usernames = [fields['username'] for _, fields in records]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        User.objects.bulk_create(
+            User(username=fields['username'], **{name: fields[name] for name in USER_FIELDS if name in fields})
+            for _, fields in records if fields['username'] not in existing
+        )
+        ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+        for pk, fields in records:
+            self.pk_maps['auth.user'][str(pk)] = ids[fields['username']]
+
+    def _load_countries(self, records):
+        names = {fields['iso_code']: fields['name'] for _, fields in records}
+        existing = Country.objects.filter(iso_code__in=names)
+        for country in existing:
+            country.name = names[country.iso_code]
+        Country.objects.bulk_update(existing, ['name'])
+        Country.objects.bulk_create(
+            Country(iso_code=iso_code, name=name) for iso_code, name in names.items()
+            if iso_code not in self.country_ids
+        )
+        self.country_ids.update(Country.objects.filter(iso_code__in=names).values_list('iso_code', 'id'))
+        for pk, fields in records:
+            self.pk_maps['companies.country'][str(pk)] = self.country_ids[fields['iso_code']]
+
+    def _country_id(self, fields):
+        if 'country' in fields:
+            return self._map('companies.country', fields['country'])
+        iso_code = fields['country__iso_code']
+        if iso_code not in self.country_ids:
+            self.country_ids[iso_code] = Country.objects.create(iso_code=iso_code, name=iso_code).pk
+        return self.country_ids[iso_code]
+
+    def _load_companies(self, records):
+        User = get_user_model()
+        usernames = {fields['creator__username'] for _, fields in records if fields.get('creator__username')}
+        user_ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+
+        companies = []
+        for pk, fields in records:
+            if 'creator' in fields:
+                creator_id = self._map('auth.user', fields['creator'])
+            else:
+                creator_id = user_ids.get(fields.get('creator__username'))
+            companies.append(Company(
+                companies_house_id=fields.get('companies_house_id') or '',
+                name=fields['name'],
+                description=fields.get('description') or '',
+                date_founded=_date(fields.get('date_founded')),
+                country_id=self._country_id(fields),
+                creator_id=creator_id,
+            ))
+
+        existing = company_ids(companies)
+        created, updated = {}, {}
+        for company in companies:
+            key = company_key(company)
+            if key in existing:
+                company.id = existing[key]
+                company._state.adding = False
+                updated[company.id] = company
+            else:
+                # A key repeated within the chunk creates one company, with the last record's fields
+                created[key] = company
+
+        Company.objects.bulk_create(created.values())
+        # Bump modified as save() would, for the change feed
+        Company.objects.bulk_update(updated.values(), COMPANY_FIELDS + ('modified',))
+        # Not every database returns the ids of bulk inserted rows
+        existing.update(company_ids(created.values()))
+        for company in companies:
+            company.id = existing[company_key(company)]
+
+        Monitor = Company.monitors.through
+        monitors = []
+        for (pk, fields), company in zip(records, companies):
+            if pk is not None:
+                self.pk_maps['companies.company'][str(pk)] = company.id
+            for user_pk in fields.get('monitors', []):
+                user_id = self._map('auth.user', user_pk)
+                if user_id is None:
+                    self.unmapped.append(('companies.company', pk, 'monitors'))
+                else:
+                    monitors.append(Monitor(company_id=company.id, user_id=user_id))
+        Monitor.objects.bulk_create(monitors, ignore_conflicts=True)
+
+    def _load_deals(self, records):
+        deals = [
+            Deal(
+                company_id=company_id,
+                date_of_deal=_date(fields['date_of_deal']),
+                amount_raised=float(fields['amount_raised']),
+            )
+            for company_id, fields in self._mapped('companies.deal', records, 'company', 'companies.company')
+        ]
+        # Deals have no natural key, so match them on what they record, as
+        # many times as each is already there
+        existing = Counter(
+            Deal.objects
+            .filter(company_id__in={deal.company_id for deal in deals})
+            .values_list('company_id', 'date_of_deal', 'amount_raised')
+        )
+        new = []
+        for deal in deals:
+            key = (deal.company_id, deal.date_of_deal, deal.amount_raised)
+            if existing[key]:
+                existing[key] -= 1
+            else:
+                new.append(deal)
+        Deal.objects.bulk_create(new)
+
+    def _load_employees(self, records):
+        # Employees are unique per company and email, which re-imports skip
+        Employee.objects.bulk_create(
+            (
+                Employee(
+                    company_id=company_id,
+                    name=fields['name'],
+                    job_title=fields['job_title'],
+                    gender=fields['gender'],
+                    email=fields['email'],
+                    phone_number=fields.get('phone_number') or '',
+                )
+                for company_id, fields in self._mapped('companies.employee', records, 'company', 'companies.company')
+            ),
+            ignore_conflicts=True,
+        )
+
+    LOADERS = {
+        'auth.user': _load_users,
+        'companies.country': _load_countries,
+        'companies.company': _load_companies,
+        'companies.deal': _load_deals,
+        'companies.employee': _load_employees,
+    }
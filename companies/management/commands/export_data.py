@@ -0,0 +1,49 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from ...exports import EXPORTS, FORMATS, export_rows, gzipped, render
+
+
+class Command(BaseCommand):
+    help = 'Stream companies, deals or employees out as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('resource', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help='gzip the output')
+        parser.add_argument('--since', help='Only rows dated on or after this ISO date')
+        parser.add_argument('--until', help='Only rows dated on or before this ISO date')
+        parser.add_argument('--country', help='Only rows for companies in this country (ISO code)')
+        parser.add_argument('--output', help='File to write to, rather than stdout')
+
+    def _date(self, options, name):
+        if options[name] is None:
+            return None
+        try:
+            value = parse_date(options[name])
+        except ValueError:
+            value = None
+        if value is None:
+            raise CommandError('--{0} must be an ISO date, e.g. 2018-01-31'.format(name))
+        return value
+
+    def handle(self, *args, **options):
+        fields, rows = export_rows(
+            options['resource'],
+            since=self._date(options, 'since'),
+            until=self._date(options, 'until'),
+            country=options['country'],
+        )
+        chunks = render(fields, rows, options['format'])
+        if options['gzip']:
+            chunks = gzipped(chunks)
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from ...cache import bump_data_version
+from ...importing import Importer, read_records
+from ...rollups import rebuild_company_stats
+
+
+class Command(BaseCommand):
+    help = 'Bulk load companies from a fixture, JSON/NDJSON feed or CSV feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='.json fixture or array, .ndjson or .csv file')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Records per insert transaction')
+        parser.add_argument(
+            '--checkpoint',
+            help='File to record progress in; an interrupted import given the same file resumes from it',
+        )
+
+    def handle(self, *args, **options):
+        def report(records_done, rate):
+            self.stdout.write('{0} records imported ({1:.0f}/s)'.format(records_done, rate))
+
+        importer = Importer(
+            batch_size=options['batch_size'],
+            checkpoint_path=options['checkpoint'],
+            report=report,
+        )
+        importer.run(read_records(options['path']))
+        rebuild_company_stats()
+        bump_data_version()
+        for model, pk, field in importer.unmapped:
+            self.stderr.write('Skipped {0} {1}: its {2} is not in the import'.format(model, pk, field))
+        self.stdout.write(self.style.SUCCESS('Imported {0} records'.format(importer.records_done)))
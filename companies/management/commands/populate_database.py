@@ -1,38 +1,59 @@
-import datetime
-import random
+import time
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from ...factories import (
-    CompanyFactory,
-    CountryFactory,
-    DealFactory,
-    EmployeeFactory,
-    UserFactory,
-)
+from ...cache import bump_data_version
+from ...factories import CountryFactory, UserFactory
+from ...rollups import rebuild_company_stats
+from ...seeding import BulkSeeder
 
 
 class Command(BaseCommand):
     help = 'Populate your database with some dummy (but realistic) data'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--companies', type=int, default=20, help='Number of companies to create')
+        parser.add_argument(
+            '--employees-per-company', type=int, default=5,
+            help='Maximum number of employees (and monitors) per company',
+        )
+        parser.add_argument(
+            '--deals-per-month', type=int, default=5,
+            help='Maximum number of deals per month since 2010, across all the companies',
+        )
+        parser.add_argument('--seed', type=int, help='Random seed, for a reproducible dataset')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Companies per insert transaction')
+        parser.add_argument(
+            '--workers', type=int, default=1, help='Number of batches to insert concurrently (not on SQLite)',
+        )
+
     def handle(self, *args, **options):
-        users = UserFactory.create_batch(10)
+        # Named explicitly, so running this again reuses them
+        users = [UserFactory(username='user{0}'.format(i)) for i in range(10)]
         countries = CountryFactory.create_batch(5)
 
-        companies = []
-        for _ in range(20):
-            company = CompanyFactory(
-                creator=random.choice(users),
-                country=random.choice(countries)
-            )
-            companies.append(company)
-            n = random.randint(0, 5)
-            if n:
-                EmployeeFactory.create_batch(n, company=company)
-                company.monitors.add(*random.sample(users, k=n))
-
-        for year in range(2010, datetime.date.today().year):
-            for month in range(1, 13):
-                for _ in range(random.randint(0, 5)):
-                    deal_date = datetime.date(year, month, random.randint(1, 28))
-                    DealFactory(company=random.choice(companies), date_of_deal=deal_date)
+        seeder = BulkSeeder(
+            users,
+            countries,
+            employees_per_company=options['employees_per_company'],
+            deals_per_month=options['deals_per_month'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+        )
+        started = time.monotonic()
+        created = [0]
+
+        def progress(n):
+            created[0] += n
+            self.stdout.write('{0}/{1} companies created'.format(created[0], options['companies']))
+
+        try:
+            seeder.seed_companies(options['companies'], workers=options['workers'], progress=progress)
+        except ValueError as e:
+            raise CommandError(e)
+        rebuild_company_stats()
+        bump_data_version()
+
+        self.stdout.write(self.style.SUCCESS('Seeded {0} companies with seed {1} in {2:.1f}s'.format(
+            options['companies'], seeder.seed, time.monotonic() - started,
+        )))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from ...cache import bump_data_version
+from ...rollups import rebuild_company_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed company stats tables from scratch'
+
+    def handle(self, *args, **options):
+        rebuild_company_stats()
+        bump_data_version()
+        self.stdout.write(self.style.SUCCESS('Rebuilt company stats'))
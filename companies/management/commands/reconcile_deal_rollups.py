@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...cache import bump_data_version
+from ...rollups import country_deal_drift, repair_country_deal_drift
+
+
+class Command(BaseCommand):
+    help = 'Check the per-country deal rollups against the deals table, and optionally repair them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Recompute the rollups which have drifted')
+
+    def handle(self, *args, **options):
+        drift = country_deal_drift()
+        for (country_id, year, quarter), expected, actual in drift:
+            self.stdout.write('Country {0} {1} Q{2}: expected {3}, found {4}'.format(
+                country_id, year, quarter, expected, actual,
+            ))
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Deal rollups are consistent'))
+        elif options['fix']:
+            repair_country_deal_drift(drift)
+            bump_data_version()
+            self.stdout.write(self.style.SUCCESS('Repaired {0} rollups'.format(len(drift))))
+        else:
+            raise CommandError('{0} rollups have drifted; rerun with --fix to repair them'.format(len(drift)))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...notifications import drain_outbox
+
+
+class Command(BaseCommand):
+    help = 'Email monitors a digest of the changes to the companies they monitor'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Outbox events per batch')
+        parser.add_argument('--workers', type=int, default=4, help='Threads sending mail')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new events')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            drained = drain_outbox(batch_size=options['batch_size'], workers=options['workers'])
+            if drained:
+                self.stdout.write('Processed {0} events'.format(drained))
+            elif options['loop']:
+                time.sleep(options['interval'])
+            else:
+                break
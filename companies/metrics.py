@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+A minimal in-process metrics registry.
+
+Counters are per process, as is usual for scraped metrics; the scraper
+aggregates across workers. `render` produces the Prometheus text format.
+"""
+from __future__ import unicode_literals
+
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((labels or {}).items()))
+
+
+def increment(name, value=1, labels=None):
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def value(name, labels=None):
+    return _counters.get(_key(name, labels), 0)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('{0}="{1}"'.format(label, label_value) for label, label_value in labels)
+
+
+def render():
+    with _lock:
+        counters = sorted(_counters.items())
+    lines = []
+    for (name, labels), count in counters:
+        lines.append('{0}{1} {2:g}'.format(name, _format_labels(labels), count))
+    return '\n'.join(lines) + '\n'
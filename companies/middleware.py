@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Per-request SQL and latency instrumentation.
+
+`QueryMetricsMiddleware` counts the queries each request runs, their total
+time and any repeated statements (the tell-tale of an N+1), reports them in
+a ``Server-Timing`` header and adds them to the `companies.metrics` registry.
+
+Views can declare how many queries they should need with `query_budget`.
+Going over budget is logged, and raises `QueryBudgetExceeded` when
+``settings.COMPANIES_ENFORCE_QUERY_BUDGETS`` is set, as it is in the tests.
+"""
+from __future__ import unicode_literals
+
+import asyncio
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_current_queries = ContextVar('current_queries', default=None)
+
+# Collapse the placeholders of IN (...) lists so they fingerprint the same
+# whatever their length
+_PLACEHOLDER_LIST_RE = re.compile(r'%s(?:\s*,\s*%s)+')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(n):
+    """Declare that the decorated view should run at most `n` queries."""
+    def decorator(view):
+        view.query_budget = n
+        return view
+    return decorator
+
+
+class RequestQueries(object):
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        # Async views may run a request's queries on several threads at once
+        self._lock = threading.Lock()
+
+    def record(self, sql, duration):
+        fingerprint = _PLACEHOLDER_LIST_RE.sub('%s', sql)
+        with self._lock:
+            self.count += 1
+            self.duration += duration
+            self.fingerprints[fingerprint] += 1
+
+    @property
+    def duplicates(self):
+        return {sql: n for sql, n in self.fingerprints.items() if n > 1}
+
+
+def record_query(execute, sql, params, many, context):
+    queries = _current_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries.record(sql, time.perf_counter() - started)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """`connection_created` receiver which wraps every query on every connection."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class QueryMetricsMiddleware(object):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Tell Django to await us rather than run us in a thread
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        queries = RequestQueries()
+        token = _current_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_queries.reset(token)
+        return self._finish(request, response, queries, started)
+
+    async def __acall__(self, request):
+        queries = RequestQueries()
+        token = _current_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_queries.reset(token)
+        return self._finish(request, response, queries, started)
+
+    def _finish(self, request, response, queries, started):
+        duration = time.perf_counter() - started
+        response['Server-Timing'] = 'db;dur={0:.2f};desc="{1} queries", total;dur={2:.2f}'.format(
+            queries.duration * 1000, queries.count, duration * 1000,
+        )
+        self._record_metrics(request, queries, duration)
+        self._check_budget(request, queries)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = getattr(view_func, 'query_budget', None)
+
+    def _record_metrics(self, request, queries, duration):
+        match = getattr(request, 'resolver_match', None)
+        labels = {'view': match.view_name if match else 'unresolved'}
+        metrics.increment('companies_requests_total', labels=labels)
+        metrics.increment('companies_request_duration_seconds_total', duration, labels=labels)
+        metrics.increment('companies_db_queries_total', queries.count, labels=labels)
+        metrics.increment('companies_db_duration_seconds_total', queries.duration, labels=labels)
+        metrics.increment('companies_db_duplicate_queries_total', sum(queries.duplicates.values()), labels=labels)
+
+    def _check_budget(self, request, queries):
+        budget = getattr(request, 'query_budget', None)
+        if budget is None or queries.count <= budget:
+            return
+        message = '{0} ran {1} queries, over its budget of {2}. Repeated: {3}'.format(
+            request.path, queries.count, budget, queries.duplicates,
+        )
+        if getattr(settings, 'COMPANIES_ENFORCE_QUERY_BUDGETS', False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
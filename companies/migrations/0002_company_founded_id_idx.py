@@ -0,0 +1,17 @@
+# Generated by Django 3.2.5 on 2026-10-17 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['date_founded', 'id'], name='company_founded_id_idx'),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 3.2.5 on 2026-10-17 17:54
+
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractQuarter, ExtractYear
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+def fill_rollups(apps, schema_editor):
+    Company = apps.get_model('companies', 'Company')
+    Deal = apps.get_model('companies', 'Deal')
+    Employee = apps.get_model('companies', 'Employee')
+    CompanyStatsSnapshot = apps.get_model('companies', 'CompanyStatsSnapshot')
+    FoundingQuarterRollup = apps.get_model('companies', 'FoundingQuarterRollup')
+    CountryDealRollup = apps.get_model('companies', 'CountryDealRollup')
+
+    # The same singleton id as CompanyStatsSnapshot.SINGLETON_ID
+    CompanyStatsSnapshot.objects.create(
+        pk=1, company_count=Company.objects.count(), employee_count=Employee.objects.count(),
+    )
+    founded = (
+        Company.objects
+        .filter(date_founded__isnull=False)
+        .values(year=ExtractYear('date_founded'), quarter=ExtractQuarter('date_founded'))
+        .annotate(company_count=Count('id'))
+        .order_by()
+    )
+    FoundingQuarterRollup.objects.bulk_create(FoundingQuarterRollup(**row) for row in founded)
+    deals = (
+        Deal.objects
+        .values(country_id=F('company__country_id'))
+        .annotate(deal_count=Count('id'), amount_raised_total=Sum('amount_raised'))
+        .order_by()
+    )
+    CountryDealRollup.objects.bulk_create(CountryDealRollup(**row) for row in deals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0002_company_founded_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompanyStatsSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('company_count', models.IntegerField(default=0)),
+                ('employee_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='FoundingQuarterRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('quarter', models.PositiveSmallIntegerField()),
+                ('company_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('year', 'quarter')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CountryDealRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deal_count', models.IntegerField(default=0)),
+                ('amount_raised_total', models.FloatField(default=0)),
+                ('country', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='companies.country')),
+            ],
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
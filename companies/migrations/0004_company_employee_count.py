@@ -0,0 +1,35 @@
+# Generated by Django 3.2.5 on 2026-10-17 17:55
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_employees(apps, schema_editor):
+    Company = apps.get_model('companies', 'Company')
+    Employee = apps.get_model('companies', 'Employee')
+    counts = (
+        Employee.objects
+        .filter(company=OuterRef('pk'))
+        .order_by()
+        .values('company')
+        .annotate(n=Count('id'))
+        .values('n')
+    )
+    Company.objects.update(employee_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0003_company_stats_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='employee_count',
+            field=models.IntegerField(db_index=True, default=0, editable=False, help_text='Number of employees, kept up to date by companies.signals'),
+        ),
+        migrations.RunPython(count_employees, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.5 on 2026-10-17 18:20
+
+from django.db import migrations, models
+
+MONITORS_USER_IDX = models.Index(fields=['user', 'company'], name='company_monitors_user_idx')
+
+
+def _monitors(apps):
+    return apps.get_model('companies', 'Company').monitors.through
+
+
+def add_index(apps, schema_editor):
+    schema_editor.add_index(_monitors(apps), MONITORS_USER_IDX)
+
+
+def remove_index(apps, schema_editor):
+    schema_editor.remove_index(_monitors(apps), MONITORS_USER_IDX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0004_company_employee_count'),
+    ]
+
+    # The auto-created through table's unique index is (company_id, user_id);
+    # listing a user's monitored companies in company order wants it the
+    # other way round. The through model isn't in the migration state, so
+    # AddIndex can't be used, but the schema editor writes the same SQL for
+    # each backend.
+    operations = [
+        migrations.RunPython(add_index, remove_index),
+    ]
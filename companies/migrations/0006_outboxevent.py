@@ -0,0 +1,24 @@
+# Generated by Django 3.2.5 on 2026-10-17 18:05
+
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0005_company_monitors_user_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('company_id', models.IntegerField()),
+                ('description', models.CharField(max_length=255)),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False)),
+            ],
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.2.5 on 2026-10-17 18:40
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import ExtractQuarter, ExtractYear
+import django.db.models.deletion
+
+
+def fill_rollups(apps, schema_editor):
+    CountryDealRollup = apps.get_model('companies', 'CountryDealRollup')
+    Deal = apps.get_model('companies', 'Deal')
+    totals = (
+        Deal.objects
+        .values(
+            country_id=F('company__country_id'),
+            year=ExtractYear('date_of_deal'),
+            quarter=ExtractQuarter('date_of_deal'),
+        )
+        .annotate(
+            deal_count=Count('id'),
+            amount_raised_total=Sum('amount_raised'),
+            amount_raised_min=Min('amount_raised'),
+            amount_raised_max=Max('amount_raised'),
+        )
+        .order_by()
+    )
+    CountryDealRollup.objects.bulk_create(CountryDealRollup(**row) for row in totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0006_outboxevent'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='CountryDealRollup',
+        ),
+        migrations.CreateModel(
+            name='CountryDealRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('quarter', models.PositiveSmallIntegerField()),
+                ('deal_count', models.IntegerField(default=0)),
+                ('amount_raised_total', models.FloatField(default=0)),
+                ('amount_raised_min', models.FloatField(null=True)),
+                ('amount_raised_max', models.FloatField(null=True)),
+                ('country', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='companies.country')),
+            ],
+            options={
+                'unique_together': {('country', 'year', 'quarter')},
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.5 on 2026-10-17 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0007_country_deal_rollup_quarters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['creator', 'employee_count'], name='company_creator_employees_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['companies_house_id'], name='company_house_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deal',
+            index=models.Index(fields=['company', 'date_of_deal'], name='deal_company_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deal',
+            index=models.Index(fields=['date_of_deal'], name='deal_date_idx'),
+        ),
+    ]
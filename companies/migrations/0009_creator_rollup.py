@@ -0,0 +1,54 @@
+# Generated by Django 3.2.5 on 2026-10-17 18:19
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+
+
+def fill_rollups(apps, schema_editor):
+    CreatorRollup = apps.get_model('companies', 'CreatorRollup')
+    Company = apps.get_model('companies', 'Company')
+    totals = (
+        Company.objects
+        .filter(creator__isnull=False)
+        .values('creator')
+        .annotate(company_count=Count('id'), employee_count=Sum('employee_count'))
+        .order_by()
+    )
+    CreatorRollup.objects.bulk_create(
+        CreatorRollup(
+            user_id=row['creator'],
+            company_count=row['company_count'],
+            employee_count=row['employee_count'],
+        )
+        for row in totals
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('companies', '0008_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CreatorRollup',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='creator_rollup', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('company_count', models.IntegerField(default=0)),
+                ('employee_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='creatorrollup',
+            index=models.Index(fields=['company_count'], name='creator_rollup_companies_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='creatorrollup',
+            index=models.Index(fields=['employee_count'], name='creator_rollup_employees_idx'),
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 3.2.5 on 2026-10-17 19:05
+
+from django.db import migrations
+
+# Keep in step with companies.search
+FORWARDS = {
+    'sqlite': [
+        """
+        CREATE VIRTUAL TABLE companies_company_fts USING fts5(
+            name, description,
+            content='companies_company', content_rowid='id',
+            prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER companies_company_fts_insert AFTER INSERT ON companies_company BEGIN
+            INSERT INTO companies_company_fts (rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+        """,
+        """
+        CREATE TRIGGER companies_company_fts_delete AFTER DELETE ON companies_company BEGIN
+            INSERT INTO companies_company_fts (companies_company_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END
+        """,
+        """
+        CREATE TRIGGER companies_company_fts_update AFTER UPDATE OF name, description ON companies_company
+        WHEN old.name IS NOT new.name OR old.description IS NOT new.description BEGIN
+            INSERT INTO companies_company_fts (companies_company_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO companies_company_fts (rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+        """,
+        # Names count ten times as much as descriptions
+        "INSERT INTO companies_company_fts (companies_company_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+        "INSERT INTO companies_company_fts (companies_company_fts) VALUES ('rebuild')",
+    ],
+    'postgresql': [
+        """
+        CREATE INDEX company_search_idx ON companies_company USING GIN ((
+            setweight(to_tsvector('simple', name), 'A') || setweight(to_tsvector('simple', description), 'B')
+        ))
+        """,
+    ],
+}
+
+BACKWARDS = {
+    'sqlite': [
+        'DROP TRIGGER companies_company_fts_update',
+        'DROP TRIGGER companies_company_fts_delete',
+        'DROP TRIGGER companies_company_fts_insert',
+        'DROP TABLE companies_company_fts',
+    ],
+    'postgresql': [
+        'DROP INDEX company_search_idx',
+    ],
+}
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0010_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(FORWARDS), run(BACKWARDS)),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.5 on 2026-10-17 18:30
+
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0011_company_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource', models.CharField(max_length=20)),
+                ('object_id', models.IntegerField()),
+                ('deleted', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['modified', 'id'], name='company_modified_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deal',
+            index=models.Index(fields=['modified', 'id'], name='deal_modified_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['modified', 'id'], name='employee_modified_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['deleted', 'id'], name='tombstone_deleted_id_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-17 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0012_change_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxevent',
+            name='claimed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
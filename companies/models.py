@@ -3,6 +3,8 @@ from __future__ import unicode_literals
 
 from django.conf import settings
 from django.db import models
+from model_utils import FieldTracker
+from model_utils.fields import AutoCreatedField
 from model_utils.models import TimeStampedModel
 
 
@@ -10,7 +12,7 @@ class Country(models.Model):
     iso_code = models.CharField(max_length=3, unique=True)
     name = models.CharField(max_length=200)
 
-    def __unicode__(self):
+    def __str__(self):
         return u'{0}'.format(self.name)
 
 
@@ -32,17 +34,57 @@ class Company(TimeStampedModel):
         related_name='companies_monitored',
         help_text='Users who want to be notified of updates to this company'
     )
+    employee_count = models.IntegerField(
+        default=0,
+        editable=False,
+        db_index=True,
+        help_text='Number of employees, kept up to date by companies.signals'
+    )
+
+    tracker = FieldTracker(fields=['companies_house_id', 'name', 'description', 'date_founded', 'country', 'creator'])
 
-    def __unicode__(self):
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_founded', 'id'], name='company_founded_id_idx'),
+            models.Index(fields=['creator', 'employee_count'], name='company_creator_employees_idx'),
+            models.Index(fields=['companies_house_id'], name='company_house_id_idx'),
+            models.Index(fields=['name'], name='company_name_idx'),
+            models.Index(fields=['modified', 'id'], name='company_modified_id_idx'),
+        ]
+
+    def __str__(self):
         return u'{0}'.format(self.name)
 
+    @classmethod
+    def saved_fields(cls):
+        """
+        The fields to pass as ``update_fields`` when saving changes to a
+        loaded company, as `CompanyAdmin` does.
+
+        employee_count is only ever changed with F() updates, so saving it
+        would overwrite it with whatever the instance loaded.
+        """
+        return [
+            field.name for field in cls._meta.concrete_fields
+            if not field.primary_key and field.name != 'employee_count'
+        ]
+
 
 class Deal(TimeStampedModel):
     company = models.ForeignKey(Company, on_delete=models.CASCADE)
     date_of_deal = models.DateField()
     amount_raised = models.FloatField()
 
-    def __unicode__(self):
+    tracker = FieldTracker(fields=['company', 'date_of_deal', 'amount_raised'])
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['company', 'date_of_deal'], name='deal_company_date_idx'),
+            models.Index(fields=['date_of_deal'], name='deal_date_idx'),
+            models.Index(fields=['modified', 'id'], name='deal_modified_id_idx'),
+        ]
+
+    def __str__(self):
         return u'{0} raised by {1} ({2})'.format(
             self.amount_raised,
             self.company,
@@ -65,8 +107,111 @@ class Employee(TimeStampedModel):
     email = models.EmailField()
     phone_number = models.CharField(max_length=20, blank=True)
 
+    tracker = FieldTracker(fields=['company'])
+
     class Meta:
         unique_together = ('company', 'email')
+        indexes = [
+            models.Index(fields=['email'], name='employee_email_idx'),
+            models.Index(fields=['modified', 'id'], name='employee_modified_id_idx'),
+        ]
 
-    def __unicode__(self):
+    def __str__(self):
         return u'{0} ({1})'.format(self.name, self.company)
+
+
+class CompanyStatsSnapshot(TimeStampedModel):
+    """
+    Running totals behind the company stats.
+
+    There is only ever one row (see `get`). It, `FoundingQuarterRollup`,
+    `CountryDealRollup` and `CreatorRollup` are kept up to date by the handlers in
+    `companies.signals`, and rebuilt from scratch by the
+    `rebuild_company_stats` management command.
+    """
+    SINGLETON_ID = 1
+
+    company_count = models.IntegerField(default=0)
+    employee_count = models.IntegerField(default=0)
+
+    @classmethod
+    def get(cls):
+        # Reads never create the row: an empty database just has zero totals
+        return cls.objects.filter(pk=cls.SINGLETON_ID).first() or cls(pk=cls.SINGLETON_ID)
+
+
+class FoundingQuarterRollup(models.Model):
+    year = models.PositiveSmallIntegerField()
+    quarter = models.PositiveSmallIntegerField()
+    company_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('year', 'quarter')
+
+
+class CountryDealRollup(models.Model):
+    """Deal totals for the companies in a country, per quarter of the deal date."""
+    country = models.ForeignKey(Country, on_delete=models.CASCADE)
+    year = models.PositiveSmallIntegerField()
+    quarter = models.PositiveSmallIntegerField()
+    deal_count = models.IntegerField(default=0)
+    amount_raised_total = models.FloatField(default=0)
+    amount_raised_min = models.FloatField(null=True)
+    amount_raised_max = models.FloatField(null=True)
+
+    class Meta:
+        unique_together = ('country', 'year', 'quarter')
+
+
+class CreatorRollup(models.Model):
+    """
+    The companies a user created and the employees across them, for the
+    creator leaderboards (see `companies.stats.top_creators`).
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='creator_rollup'
+    )
+    company_count = models.IntegerField(default=0)
+    employee_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['company_count'], name='creator_rollup_companies_idx'),
+            models.Index(fields=['employee_count'], name='creator_rollup_employees_idx'),
+        ]
+
+
+class OutboxEvent(models.Model):
+    """
+    A change to a company which its monitors haven't been told about yet.
+
+    Written by `companies.signals` and drained by the `send_notifications`
+    command. `company_id` is deliberately not a foreign key: events are
+    written while a company's deals and employees are being deleted along
+    with it.
+
+    `claimed` is set while a drain is sending an event's digest, and
+    cleared again if sending fails.
+    """
+    company_id = models.IntegerField()
+    description = models.CharField(max_length=255)
+    created = AutoCreatedField()
+    claimed = models.DateTimeField(null=True, blank=True)
+
+
+class Tombstone(models.Model):
+    """
+    A deleted Company, Deal or Employee, for the change feed (see
+    `companies.changes`). Written by `companies.signals`.
+    """
+    resource = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+    deleted = AutoCreatedField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted', 'id'], name='tombstone_deleted_id_idx'),
+        ]
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Batched notification of company monitors.
+
+Changes are queued as `OutboxEvent` rows as they're saved, which keeps saves
+cheap however many monitors a company has. `drain_outbox` turns a batch of
+them into one digest per company, addressed to all of its monitors at once,
+and sends the digests from a thread pool.
+
+Events are claimed in a short transaction and the mail sent after it
+commits, so a slow or failing mail server doesn't hold locks. Each digest's
+events are deleted once it's sent, and released to be retried if sending
+fails, so one failure doesn't resend the digests which did go out. Events
+claimed by a drain which died are taken up again after `CLAIM_TIMEOUT`.
+"""
+from __future__ import unicode_literals
+
+import datetime
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import utils
+from .models import Company, OutboxEvent
+
+
+def enqueue(company_id, description):
+    OutboxEvent.objects.create(company_id=company_id, description=description)
+
+
+CLAIM_TIMEOUT = datetime.timedelta(minutes=10)
+
+
+def _digests(events):
+    """The ids of the events for each company, with its digest, or None if nobody monitors it."""
+    changes = OrderedDict()
+    for event in events:
+        changes.setdefault(event.company_id, []).append(event)
+
+    names = dict(Company.objects.filter(pk__in=changes).values_list('pk', 'name'))
+    recipients = defaultdict(list)
+    monitors = (
+        Company.monitors.through.objects
+        .filter(company_id__in=names)
+        .exclude(user__email='')
+        .values_list('company_id', 'user__email')
+    )
+    for company_id, email in monitors:
+        recipients[company_id].append(email)
+
+    for company_id, company_events in changes.items():
+        message = None
+        if recipients[company_id]:
+            subject = 'Updates to {0}'.format(names[company_id])
+            body = '\n'.join('* {0}'.format(event.description) for event in company_events)
+            message = sorted(recipients[company_id]), subject, body
+        yield [event.pk for event in company_events], message
+
+
+def _claim(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects
+            .select_for_update(skip_locked=True)
+            .filter(Q(claimed__isnull=True) | Q(claimed__lt=now - CLAIM_TIMEOUT))
+            .order_by('pk')[:batch_size]
+        )
+        OutboxEvent.objects.filter(pk__in=[event.pk for event in events]).update(claimed=now)
+    return events
+
+
+def _send(message):
+    if message is not None:
+        utils.send_mail(*message)
+
+
+def drain_outbox(batch_size=500, workers=4):
+    """
+    Send digests for the oldest `batch_size` unclaimed events and delete
+    them, returning how many there were.
+
+    Raises the first error from sending, once the digests which were sent
+    are deleted and the rest released.
+    """
+    events = _claim(batch_size)
+    if not events:
+        return 0
+
+    digests = list(_digests(events))
+    sent, failed, error = [], [], None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(event_ids, executor.submit(_send, message)) for event_ids, message in digests]
+        for event_ids, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failed.extend(event_ids)
+                error = error or e
+            else:
+                sent.extend(event_ids)
+
+    OutboxEvent.objects.filter(pk__in=sent).delete()
+    OutboxEvent.objects.filter(pk__in=failed).update(claimed=None)
+    if error is not None:
+        raise error
+    return len(events)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db.models import F, Q
+
+from .models import Company
+
+RECENTLY_FOUNDED_FIELDS = (
+    'id',
+    'companies_house_id',
+    'name',
+    'description',
+    'date_founded',
+    'country__iso_code',
+    'creator__username',
+)
+
+
+def parse_founded_cursor(value):
+    """
+    Parse a ``<date>,<id>`` keyset cursor, as produced by `founded_cursor`.
+
+    A blank date stands for a company with no `date_founded`, which sort last.
+    Raises `ValueError` for anything malformed.
+    """
+    date_part, _, id_part = value.partition(',')
+    date_founded = datetime.date.fromisoformat(date_part) if date_part else None
+    return date_founded, int(id_part)
+
+
+def founded_cursor(company):
+    date_founded = company['date_founded']
+    return '{0},{1}'.format(date_founded.isoformat() if date_founded else '', company['id'])
+
+
+def recently_founded(before=None):
+    """
+    Companies, most recently founded first, as dicts of `RECENTLY_FOUNDED_FIELDS`.
+
+    Ordering and the country/creator joins happen in a single query backed
+    by the ``(date_founded, id)`` index. Pass a cursor from
+    `parse_founded_cursor` as `before` to start after it.
+
+    After a dated cursor only the dated companies are included, so that the
+    query seeks to the cursor in the index rather than walking it from the
+    start: the undated ones, which sort last, come from `undated` (see
+    `most_recently_founded_companies`).
+    """
+    queryset = Company.objects.order_by(
+        F('date_founded').desc(nulls_last=True),
+        F('id').desc(),
+    )
+
+    if before is not None:
+        date_founded, pk = before
+        if date_founded is None:
+            queryset = queryset.filter(date_founded__isnull=True, id__lt=pk)
+        else:
+            # The first condition alone bounds the index range
+            queryset = queryset.filter(
+                Q(date_founded__lte=date_founded),
+                Q(date_founded__lt=date_founded) | Q(id__lt=pk),
+            )
+
+    return queryset.values(*RECENTLY_FOUNDED_FIELDS)
+
+
+def undated():
+    """The companies with no `date_founded`, in `recently_founded` order."""
+    return recently_founded().filter(date_founded__isnull=True)
+
+
+def _limited(queryset, limit):
+    return list(queryset[:limit] if limit else queryset)
+
+
+def most_recently_founded_companies(limit=10, before=None):
+    """
+    The `limit` most recently founded companies, see `recently_founded`.
+
+    A page after a dated cursor which runs out of dated companies takes a
+    second query for the undated ones.
+    """
+    companies = _limited(recently_founded(before), limit)
+    if before is not None and before[0] is not None and not (limit and len(companies) == limit):
+        companies += _limited(undated(), limit and limit - len(companies))
+    return companies
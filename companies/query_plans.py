@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Checks on how the database plans to run a queryset.
+
+`full_table_scans` runs ``EXPLAIN`` for a queryset and lists the tables it
+would read end to end rather than through an index. The tests use
+`assert_no_full_table_scans` to pin the hot-path queries to the indexes in
+the migrations, so that a changed query or a dropped index fails loudly
+instead of quietly getting slower as the tables grow. `index_searches`
+lists the tables it would seek into with an index condition, for queries
+which mustn't walk an index from its start either.
+"""
+from __future__ import unicode_literals
+
+import json
+import re
+
+from django.db import connections
+
+# "SCAN companies_company", "SCAN TABLE companies_company AS U0" or a scan
+# of a whole covering index, but not "SCAN companies_company USING INDEX ..."
+# which walks an index in order and stops at the LIMIT.
+_SQLITE_SCAN_RE = re.compile(
+    r'^SCAN (?:TABLE )?(?P<table>\w+)(?: AS \w+)?(?: USING COVERING INDEX \w+)?$'
+)
+# "SEARCH companies_company USING INDEX company_founded_id_idx (date_founded<?)"
+_SQLITE_SEARCH_RE = re.compile(r'^SEARCH (?:TABLE )?(?P<table>\w+)(?: AS \w+)? USING (?:COVERING )?INDEX ')
+# Subqueries in FROM, whose scans are of their (already planned) results
+_SQLITE_SUBQUERY_RE = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (?P<name>\w+)$')
+
+
+def _sqlite_plan(cursor, sql, params):
+    """The tables scanned in full and those searched through an index."""
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    scans, searches, subqueries = [], [], set()
+    for row in cursor.fetchall():
+        match = _SQLITE_SCAN_RE.match(row[-1])
+        if match:
+            scans.append(match.group('table'))
+        match = _SQLITE_SEARCH_RE.match(row[-1])
+        if match:
+            searches.append(match.group('table'))
+        match = _SQLITE_SUBQUERY_RE.match(row[-1])
+        if match:
+            subqueries.add(match.group('name'))
+    return [table for table in scans if table not in subqueries], searches
+
+
+def _postgresql_plan(cursor, sql, params):
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    scans, searches = [], []
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if node['Node Type'] == 'Seq Scan':
+            scans.append(node['Relation Name'])
+        elif node['Node Type'] in ('Index Scan', 'Index Only Scan') and 'Index Cond' in node:
+            searches.append(node['Relation Name'])
+        nodes.extend(node.get('Plans', ()))
+    return scans, searches
+
+
+_EXPLAINERS = {
+    'sqlite': _sqlite_plan,
+    'postgresql': _postgresql_plan,
+}
+
+
+def _explain(queryset):
+    connection = connections[queryset.db]
+    try:
+        explain = _EXPLAINERS[connection.vendor]
+    except KeyError:
+        raise NotImplementedError("Can't read query plans from %s" % connection.vendor)
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        return explain(cursor, sql, params)
+
+
+def full_table_scans(queryset, allowed=()):
+    """
+    The names of the tables `queryset` would read in full, minus `allowed`.
+
+    Raises NotImplementedError for database vendors other than SQLite and
+    PostgreSQL.
+    """
+    scans, _ = _explain(queryset)
+    return [table for table in scans if table not in allowed]
+
+
+def index_searches(queryset):
+    """The names of the tables `queryset` would seek into through an index, like `full_table_scans`."""
+    _, searches = _explain(queryset)
+    return searches
+
+
+def assert_no_full_table_scans(queryset, allowed=()):
+    scans = full_table_scans(queryset, allowed=allowed)
+    assert not scans, 'Full table scan of %s in:\n%s' % (', '.join(scans), queryset.query)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental maintenance of the precomputed company stats tables and counters.
+
+The `apply_*` functions are called from `companies.signals` with the change
+that was just saved or deleted and adjust the affected rows with `F()`
+arithmetic, so concurrent writers never lose updates. `rebuild_company_stats`
+recomputes everything from the base tables; use it after bulk loads, which
+bypass signals.
+"""
+from __future__ import unicode_literals
+
+import datetime
+import math
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, ExtractQuarter, ExtractYear, Greatest, Least
+from django.utils import timezone
+
+from .models import (
+    Company,
+    CompanyStatsSnapshot,
+    CountryDealRollup,
+    CreatorRollup,
+    Deal,
+    Employee,
+    FoundingQuarterRollup,
+)
+
+
+def quarter_of(date):
+    return date.year, (date.month - 1) // 3 + 1
+
+
+def _increment(model, lookup, **deltas):
+    """Add `deltas` to the row matching `lookup`, creating it if need be."""
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if not model.objects.filter(**lookup).update(**changes):
+        model.objects.get_or_create(**lookup)
+        model.objects.filter(**lookup).update(**changes)
+
+
+def _increment_snapshot(**deltas):
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    changes['modified'] = timezone.now()
+    if not CompanyStatsSnapshot.objects.filter(pk=CompanyStatsSnapshot.SINGLETON_ID).update(**changes):
+        # The change we're applying is already in the base tables, so the
+        # rebuilt snapshot includes it.
+        rebuild_snapshot()
+
+
+def apply_company_founded(date_founded, delta):
+    if date_founded is not None:
+        year, quarter = quarter_of(date_founded)
+        _increment(FoundingQuarterRollup, {'year': year, 'quarter': quarter}, company_count=delta)
+
+
+def apply_company_count(delta):
+    _increment_snapshot(company_count=delta)
+
+
+def apply_employee_count(delta):
+    _increment_snapshot(employee_count=delta)
+
+
+def apply_company_employees(company_id, delta):
+    Company.objects.filter(pk=company_id).update(employee_count=F('employee_count') + delta)
+
+
+def apply_creator(creator_id, companies=0, employees=0):
+    if creator_id is not None:
+        _increment(CreatorRollup, {'user_id': creator_id}, company_count=companies, employee_count=employees)
+
+
+def apply_creator_employees(company_id, delta):
+    """Add `delta` employees to the totals of the user who created a company."""
+    creators = Company.objects.filter(pk=company_id).values('creator_id')
+    changed = CreatorRollup.objects.filter(user_id=Subquery(creators)).update(
+        employee_count=F('employee_count') + delta,
+    )
+    if not changed:
+        apply_creator(creators.values_list('creator_id', flat=True).first(), employees=delta)
+
+
+def apply_company_creator_changed(company_id, old_creator_id, new_creator_id):
+    employees = Company.objects.filter(pk=company_id).values_list('employee_count', flat=True).first() or 0
+    apply_creator(old_creator_id, companies=-1, employees=-employees)
+    apply_creator(new_creator_id, companies=1, employees=employees)
+
+
+def quarter_dates(year, quarter):
+    """The first and last day of a quarter."""
+    first = datetime.date(year, (quarter - 1) * 3 + 1, 1)
+    following = datetime.date(year + quarter // 4, quarter % 4 * 3 + 1, 1)
+    return first, following - datetime.timedelta(days=1)
+
+
+def _country_deal_totals(deals):
+    """`deals` grouped into `CountryDealRollup` field values, one dict per country and quarter."""
+    return (
+        deals
+        .values(
+            country_id=F('company__country_id'),
+            year=ExtractYear('date_of_deal'),
+            quarter=ExtractQuarter('date_of_deal'),
+        )
+        .annotate(
+            deal_count=Count('id'),
+            amount_raised_total=Sum('amount_raised'),
+            amount_raised_min=Min('amount_raised'),
+            amount_raised_max=Max('amount_raised'),
+        )
+        .order_by()
+    )
+
+
+def apply_deal(country_id, date_of_deal, amount_raised, delta):
+    if country_id is None:
+        return
+    year, quarter = quarter_of(date_of_deal)
+    lookup = {'country_id': country_id, 'year': year, 'quarter': quarter}
+    rollups = CountryDealRollup.objects.filter(**lookup)
+
+    if delta > 0:
+        changes = {
+            'deal_count': F('deal_count') + 1,
+            'amount_raised_total': F('amount_raised_total') + amount_raised,
+            'amount_raised_min': Least(F('amount_raised_min'), Value(amount_raised)),
+            'amount_raised_max': Greatest(F('amount_raised_max'), Value(amount_raised)),
+        }
+        if not rollups.update(**changes):
+            CountryDealRollup.objects.get_or_create(
+                defaults={'amount_raised_min': amount_raised, 'amount_raised_max': amount_raised},
+                **lookup
+            )
+            rollups.update(**changes)
+    else:
+        rollups.update(
+            deal_count=F('deal_count') - 1,
+            amount_raised_total=F('amount_raised_total') - amount_raised,
+        )
+        # The minimum and maximum can't be backed out arithmetically
+        if rollups.filter(Q(amount_raised_min__gte=amount_raised) | Q(amount_raised_max__lte=amount_raised)).exists():
+            refresh_country_deals([country_id], [(year, quarter)])
+
+
+def refresh_country_deals(country_ids, quarters):
+    """Recompute the rollups for the given countries and (year, quarter)s from the deals table."""
+    if not country_ids or not quarters:
+        return
+    in_quarters, dated_in_quarters = Q(), Q()
+    for year, quarter in quarters:
+        in_quarters |= Q(year=year, quarter=quarter)
+        dated_in_quarters |= Q(date_of_deal__range=quarter_dates(year, quarter))
+
+    CountryDealRollup.objects.filter(in_quarters, country_id__in=country_ids).delete()
+    deals = Deal.objects.filter(dated_in_quarters, company__country_id__in=country_ids)
+    CountryDealRollup.objects.bulk_create(CountryDealRollup(**row) for row in _country_deal_totals(deals))
+
+
+def apply_company_moved(company_id, old_country_id, new_country_id):
+    """Move the deals of a company whose country changed to its new country's totals."""
+    quarters = set(
+        Deal.objects
+        .filter(company_id=company_id)
+        .values_list(ExtractYear('date_of_deal'), ExtractQuarter('date_of_deal'))
+        .distinct()
+    )
+    refresh_country_deals([old_country_id, new_country_id], quarters)
+
+
+def _rollup_key(row):
+    return row['country_id'], row['year'], row['quarter']
+
+
+def _rollups_match(expected, actual):
+    if expected is None or actual is None:
+        return False
+    return all(
+        expected[field] == actual[field] if field == 'deal_count' else math.isclose(expected[field], actual[field])
+        for field in ('deal_count', 'amount_raised_total', 'amount_raised_min', 'amount_raised_max')
+    )
+
+
+def country_deal_drift():
+    """
+    The `CountryDealRollup` rows which don't match the deals table.
+
+    Returns a list of ``(key, expected, actual)``, where `key` is
+    ``(country_id, year, quarter)`` and `expected` or `actual` is None when
+    the row should not or does not exist.
+    """
+    expected = {_rollup_key(row): row for row in _country_deal_totals(Deal.objects.all())}
+    actual = {_rollup_key(row): row for row in CountryDealRollup.objects.values(
+        'country_id', 'year', 'quarter',
+        'deal_count', 'amount_raised_total', 'amount_raised_min', 'amount_raised_max',
+    )}
+    return [
+        (key, expected.get(key), actual.get(key))
+        for key in sorted(set(expected) | set(actual))
+        if not _rollups_match(expected.get(key), actual.get(key))
+    ]
+
+
+@transaction.atomic
+def repair_country_deal_drift(drift):
+    for (country_id, year, quarter), _, _ in drift:
+        refresh_country_deals([country_id], [(year, quarter)])
+
+
+def rebuild_snapshot():
+    CompanyStatsSnapshot.objects.update_or_create(
+        pk=CompanyStatsSnapshot.SINGLETON_ID,
+        defaults={
+            'company_count': Company.objects.count(),
+            'employee_count': Employee.objects.count(),
+        },
+    )
+
+
+def rebuild_employee_counts():
+    counts = (
+        Employee.objects
+        .filter(company=OuterRef('pk'))
+        .order_by()
+        .values('company')
+        .annotate(n=Count('id'))
+        .values('n')
+    )
+    Company.objects.update(employee_count=Coalesce(Subquery(counts), 0))
+
+
+def _creator_totals():
+    return (
+        Company.objects
+        .filter(creator__isnull=False)
+        .values(user_id=F('creator'))
+        .annotate(company_count=Count('id'), employee_count=Sum('employee_count'))
+        .order_by()
+    )
+
+
+def rebuild_creators():
+    """Recompute `CreatorRollup` from the companies' `employee_count`, which must be up to date."""
+    CreatorRollup.objects.all().delete()
+    CreatorRollup.objects.bulk_create(CreatorRollup(**row) for row in _creator_totals())
+
+
+def rebuild_founding_quarters():
+    counts = (
+        Company.objects
+        .filter(date_founded__isnull=False)
+        .annotate(year=ExtractYear('date_founded'), quarter=ExtractQuarter('date_founded'))
+        .values('year', 'quarter')
+        .annotate(company_count=Count('id'))
+        .order_by()
+    )
+    FoundingQuarterRollup.objects.all().delete()
+    FoundingQuarterRollup.objects.bulk_create(FoundingQuarterRollup(**row) for row in counts)
+
+
+def rebuild_country_deals():
+    CountryDealRollup.objects.all().delete()
+    CountryDealRollup.objects.bulk_create(
+        CountryDealRollup(**row) for row in _country_deal_totals(Deal.objects.all())
+    )
+
+
+@transaction.atomic
+def rebuild_company_stats():
+    rebuild_snapshot()
+    rebuild_employee_counts()
+    rebuild_creators()
+    rebuild_founding_quarters()
+    rebuild_country_deals()
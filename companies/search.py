@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Full text search over company names and descriptions.
+
+On SQLite the search runs against ``companies_company_fts``, an FTS5 index of
+the companies table which triggers keep in step with it (see migration
+0011), so bulk inserts and queryset updates are indexed too. On PostgreSQL
+it runs against a GIN index of the weighted ``tsvector`` of the two columns.
+Other databases fall back to an unindexed, unranked ``icontains``.
+
+Every word of a query has to match the start of a word in the name or
+description, and matches in the name rank higher.
+"""
+from __future__ import unicode_literals
+
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Company
+
+MAX_TERMS = 10
+
+SEARCH_FIELDS = ('id', 'companies_house_id', 'name', 'description', 'date_founded', 'country__iso_code')
+
+_COLUMNS = (
+    'companies_company.id, companies_company.companies_house_id, companies_company.name, '
+    'companies_company.description, companies_company.date_founded, companies_country.iso_code'
+)
+
+# Keep in step with the index in migration 0011
+_POSTGRESQL_VECTOR = (
+    "setweight(to_tsvector('simple', companies_company.name), 'A') || "
+    "setweight(to_tsvector('simple', companies_company.description), 'B')"
+)
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+class _SQLiteSearch(object):
+    def _match(self, terms):
+        return ' '.join('"{0}"*'.format(term) for term in terms)
+
+    def matching_ids(self, terms):
+        return RawSQL(
+            'SELECT rowid FROM companies_company_fts WHERE companies_company_fts MATCH %s',
+            [self._match(terms)],
+        )
+
+    def search(self, cursor, terms, where, params, limit):
+        # The FTS5 rank column is bm25() with the weights set up in the
+        # migration, and ordering by it is optimised
+        cursor.execute(
+            'SELECT ' + _COLUMNS + ' FROM companies_company_fts '
+            'JOIN companies_company ON companies_company.id = companies_company_fts.rowid '
+            'JOIN companies_country ON companies_country.id = companies_company.country_id '
+            'WHERE companies_company_fts MATCH %s' + ''.join(' AND ' + clause for clause in where) + ' '
+            'ORDER BY companies_company_fts.rank LIMIT %s',
+            [self._match(terms)] + params + [limit],
+        )
+        return cursor.fetchall()
+
+
+class _PostgreSQLSearch(object):
+    def _query(self, terms):
+        return ' & '.join('{0}:*'.format(term) for term in terms)
+
+    def matching_ids(self, terms):
+        return RawSQL(
+            "SELECT id FROM companies_company WHERE " + _POSTGRESQL_VECTOR + " @@ to_tsquery('simple', %s)",
+            [self._query(terms)],
+        )
+
+    def search(self, cursor, terms, where, params, limit):
+        cursor.execute(
+            'SELECT ' + _COLUMNS + ' FROM companies_company '
+            'JOIN companies_country ON companies_country.id = companies_company.country_id '
+            "CROSS JOIN to_tsquery('simple', %s) AS query "
+            'WHERE ' + _POSTGRESQL_VECTOR + ' @@ query' + ''.join(' AND ' + clause for clause in where) + ' '
+            'ORDER BY ts_rank(' + _POSTGRESQL_VECTOR + ', query) DESC LIMIT %s',
+            [self._query(terms)] + params + [limit],
+        )
+        return cursor.fetchall()
+
+
+class _UnindexedSearch(object):
+    def _filter(self, terms):
+        q = Q()
+        for term in terms:
+            q &= Q(name__icontains=term) | Q(description__icontains=term)
+        return q
+
+    def matching_ids(self, terms):
+        return Company.objects.filter(self._filter(terms)).values('id')
+
+    def search(self, cursor, terms, where, params, limit):
+        ids, ids_params = self.matching_ids(terms).query.sql_with_params()
+        cursor.execute(
+            'SELECT ' + _COLUMNS + ' FROM companies_company '
+            'JOIN companies_country ON companies_country.id = companies_company.country_id '
+            'WHERE companies_company.id IN (' + ids + ')' + ''.join(' AND ' + clause for clause in where) + ' '
+            'ORDER BY companies_company.id LIMIT %s',
+            list(ids_params) + params + [limit],
+        )
+        return cursor.fetchall()
+
+
+_BACKENDS = {
+    'sqlite': _SQLiteSearch(),
+    'postgresql': _PostgreSQLSearch(),
+}
+
+
+def _backend(connection):
+    return _BACKENDS.get(connection.vendor, _UnindexedSearch())
+
+
+def company_matches(query):
+    """
+    The ids of the companies matching `query`, for filtering a queryset with
+    ``pk__in``, or None if `query` has no words in it.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return None
+    return _backend(connections[router.db_for_read(Company)]).matching_ids(terms)
+
+
+def search_companies(query, country=None, founded_after=None, founded_before=None, limit=20):
+    """
+    The `limit` companies best matching `query`, as dicts of `SEARCH_FIELDS`.
+
+    `country` is an ISO code; `founded_after` and `founded_before` are
+    inclusive dates.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    connection = connections[router.db_for_read(Company)]
+    where, params = [], []
+    if country:
+        where.append('companies_country.iso_code = %s')
+        params.append(country)
+    if founded_after:
+        where.append('companies_company.date_founded >= %s')
+        params.append(connection.ops.adapt_datefield_value(founded_after))
+    if founded_before:
+        where.append('companies_company.date_founded <= %s')
+        params.append(connection.ops.adapt_datefield_value(founded_before))
+
+    with connection.cursor() as cursor:
+        rows = _backend(connection).search(cursor, terms, where, params, limit)
+    return [dict(zip(SEARCH_FIELDS, row)) for row in rows]
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Fast generation of large, reproducible datasets.
+
+Rows are built in memory and written with `bulk_create`, one transaction per
+batch of companies. Each company draws from its own random generator seeded
+from the overall seed and its position, and the deals follow one schedule of
+up to ``deals_per_month`` a month across all the companies, so the data
+doesn't depend on the batch size or how many workers generated it. Faker is
+far too slow to call per row, so names are drawn from pools it fills once up
+front. Batches can be inserted
+concurrently, except on SQLite. Bulk inserts skip model signals: call
+`companies.rollups.rebuild_company_stats` once seeding is done.
+"""
+from __future__ import unicode_literals
+
+import datetime
+import random
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils.text import slugify
+from faker import Faker
+
+from .models import Company, Deal, Employee
+
+
+class BulkSeeder(object):
+    FIRST_FOUNDED = datetime.date(1990, 1, 1)
+    FIRST_DEAL_YEAR = 2010
+    POOL_SIZE = 1000
+
+    def __init__(self, users, countries, employees_per_company=5, deals_per_month=5,
+                 seed=None, batch_size=1000):
+        self.user_ids = [user.pk for user in users]
+        self.country_ids = [country.pk for country in countries]
+        self.employees_per_company = employees_per_company
+        self.deals_per_month = deals_per_month
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.batch_size = batch_size
+        self.today = datetime.date.today()
+
+        fake = Faker()
+        fake.seed_instance(self.seed)
+        self.company_names = [fake.company() for _ in range(self.POOL_SIZE)]
+        self.person_names = [fake.name() for _ in range(self.POOL_SIZE)]
+        self.job_titles = [fake.job() for _ in range(self.POOL_SIZE)]
+
+    def _random_date(self, rng, start, end):
+        return start + datetime.timedelta(days=rng.randint(0, (end - start).days))
+
+    def _company(self, rng, company_id):
+        return Company(
+            id=company_id,
+            companies_house_id='{0:08d}'.format(company_id),
+            name=rng.choice(self.company_names),
+            date_founded=self._random_date(rng, self.FIRST_FOUNDED, self.today),
+            country_id=rng.choice(self.country_ids),
+            creator_id=rng.choice(self.user_ids),
+        )
+
+    def _employees(self, rng, company):
+        employees = []
+        for i in range(company.employee_count):
+            name = rng.choice(self.person_names)
+            employees.append(Employee(
+                company_id=company.id,
+                name=name,
+                job_title=rng.choice(self.job_titles),
+                gender=rng.choice(Employee.GENDERS)[0],
+                email='{0}.{1}@site.com'.format(slugify(name), i),
+            ))
+        return employees
+
+    def _deals(self, n):
+        """The deals of `n` companies, as (company position, date, amount) lists by batch."""
+        rng = random.Random('{0}:deals'.format(self.seed))
+        batches = defaultdict(list)
+        for year in range(self.FIRST_DEAL_YEAR, self.today.year):
+            for month in range(1, 13):
+                for _ in range(rng.randint(0, self.deals_per_month)):
+                    position = rng.randrange(n)
+                    date_of_deal = datetime.date(year, month, rng.randint(1, 28))
+                    batches[position // self.batch_size].append((position, date_of_deal, rng.randint(0, 10000000)))
+        return batches
+
+    def seed_batch(self, first_id, start, n, deals=()):
+        """Create the companies at positions `start` to `start + n` with their employees and monitors, and `deals`."""
+        companies, employees, monitors = [], [], []
+        for position in range(start, start + n):
+            rng = random.Random('{0}:{1}'.format(self.seed, position))
+            company = self._company(rng, first_id + position)
+            companies.append(company)
+            company.employee_count = rng.randint(0, self.employees_per_company)
+            employees.extend(self._employees(rng, company))
+            k = min(company.employee_count, len(self.user_ids))
+            monitors.extend(
+                Company.monitors.through(company_id=company.id, user_id=user_id)
+                for user_id in rng.sample(self.user_ids, k=k)
+            )
+        deals = [
+            Deal(company_id=first_id + position, date_of_deal=date_of_deal, amount_raised=amount)
+            for position, date_of_deal, amount in deals
+        ]
+
+        with transaction.atomic():
+            Company.objects.bulk_create(companies, batch_size=self.batch_size)
+            Employee.objects.bulk_create(employees, batch_size=self.batch_size)
+            Company.monitors.through.objects.bulk_create(monitors, batch_size=self.batch_size)
+            Deal.objects.bulk_create(deals, batch_size=self.batch_size)
+        return n
+
+    def _seed_batch_in_thread(self, *args):
+        try:
+            return self.seed_batch(*args)
+        finally:
+            connection.close()
+
+    def seed_companies(self, n, workers=1, progress=None):
+        """
+        Create `n` companies with their employees, monitors and deals.
+
+        Raises ValueError for more than one worker on SQLite, which only
+        lets one transaction write at a time.
+        """
+        if workers > 1 and connection.vendor == 'sqlite':
+            raise ValueError('SQLite can only insert one batch at a time')
+        first_id = (Company.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+        deals = self._deals(n) if n else {}
+        batches = [
+            (first_id, start, min(self.batch_size, n - start), deals.get(index, []))
+            for index, start in enumerate(range(0, n, self.batch_size))
+        ]
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for created in executor.map(self._seed_batch_in_thread, *zip(*batches)):
+                    if progress:
+                        progress(created)
+        else:
+            for batch in batches:
+                created = self.seed_batch(*batch)
+                if progress:
+                    progress(created)
+
+        # Company ids were assigned explicitly, so move the sequence past them
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Company]):
+                cursor.execute(sql)
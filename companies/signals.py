@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import cache, changes, notifications, rollups
+from .models import Company, Country, Deal, Employee, Tombstone
+
+
+def _country_id(company_id):
+    return Company.objects.filter(pk=company_id).values_list('country_id', flat=True).first()
+
+
+@receiver(post_save, sender=Company)
+def company_saved(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    if created:
+        rollups.apply_company_count(1)
+        rollups.apply_company_founded(instance.date_founded, 1)
+        rollups.apply_creator(instance.creator_id, companies=1, employees=instance.employee_count)
+        return
+
+    if instance.tracker.changed():
+        notifications.enqueue(instance.pk, 'Company details updated')
+    if instance.tracker.has_changed('date_founded'):
+        rollups.apply_company_founded(instance.tracker.previous('date_founded'), -1)
+        rollups.apply_company_founded(instance.date_founded, 1)
+    if instance.tracker.has_changed('country'):
+        rollups.apply_company_moved(instance.pk, instance.tracker.previous('country'), instance.country_id)
+    if instance.tracker.has_changed('creator'):
+        rollups.apply_company_creator_changed(instance.pk, instance.tracker.previous('creator'), instance.creator_id)
+
+
+@receiver(post_delete, sender=Company)
+def company_deleted(sender, instance, **kwargs):
+    rollups.apply_company_count(-1)
+    rollups.apply_company_founded(instance.tracker.previous('date_founded'), -1)
+    # Its employees were deleted first, and took themselves off the creator's total
+    rollups.apply_creator(instance.tracker.previous('creator'), companies=-1)
+
+
+@receiver(post_save, sender=Deal)
+def deal_saved(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    notifications.enqueue(instance.company_id, 'Deal of {0} on {1} {2}'.format(
+        instance.amount_raised, instance.date_of_deal, 'added' if created else 'updated',
+    ))
+    if created:
+        rollups.apply_deal(_country_id(instance.company_id), instance.date_of_deal, instance.amount_raised, 1)
+    elif instance.tracker.changed():
+        # Recount rather than back the old values out: the saved row is
+        # already in the deals table, and the minimum and maximum can't be
+        # backed out anyway
+        rollups.refresh_country_deals(
+            {_country_id(instance.tracker.previous('company')), _country_id(instance.company_id)},
+            {rollups.quarter_of(instance.tracker.previous('date_of_deal')), rollups.quarter_of(instance.date_of_deal)},
+        )
+
+
+@receiver(post_delete, sender=Deal)
+def deal_deleted(sender, instance, **kwargs):
+    notifications.enqueue(instance.company_id, 'Deal of {0} on {1} removed'.format(
+        instance.amount_raised, instance.date_of_deal,
+    ))
+    rollups.apply_deal(_country_id(instance.company_id), instance.date_of_deal, instance.amount_raised, -1)
+
+
+@receiver(post_save, sender=Employee)
+def employee_saved(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    notifications.enqueue(instance.company_id, 'Employee {0} ({1}) {2}'.format(
+        instance.name, instance.job_title, 'added' if created else 'updated',
+    ))
+    if created:
+        rollups.apply_employee_count(1)
+        rollups.apply_company_employees(instance.company_id, 1)
+        rollups.apply_creator_employees(instance.company_id, 1)
+    elif instance.tracker.has_changed('company'):
+        for company_id, delta in ((instance.tracker.previous('company'), -1), (instance.company_id, 1)):
+            rollups.apply_company_employees(company_id, delta)
+            rollups.apply_creator_employees(company_id, delta)
+
+
+@receiver(post_delete, sender=Employee)
+def employee_deleted(sender, instance, **kwargs):
+    notifications.enqueue(instance.company_id, 'Employee {0} ({1}) removed'.format(
+        instance.name, instance.job_title,
+    ))
+    rollups.apply_employee_count(-1)
+    rollups.apply_company_employees(instance.company_id, -1)
+    rollups.apply_creator_employees(instance.company_id, -1)
+
+
+@receiver(post_delete, sender=Company)
+@receiver(post_delete, sender=Deal)
+@receiver(post_delete, sender=Employee)
+def record_deletion(sender, instance, **kwargs):
+    Tombstone.objects.create(resource=changes.RESOURCES[sender], object_id=instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Company)
+@receiver([post_save, post_delete], sender=Country)
+@receiver([post_save, post_delete], sender=Deal)
+@receiver([post_save, post_delete], sender=Employee)
+def data_changed(sender, **kwargs):
+    transaction.on_commit(cache.bump_data_version)
+
+
+@receiver(m2m_changed, sender=Company.monitors.through)
+def company_monitors_changed(sender, action, **kwargs):
+    # Monitors are listed in the company details
+    if action.startswith('post_'):
+        transaction.on_commit(cache.bump_data_version)
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, update_fields=None, **kwargs):
+    # Usernames are in the stats, but logging in saves last_login alone
+    if update_fields is None or 'username' in update_fields:
+        transaction.on_commit(cache.bump_data_version)
@@ -0,0 +1,55 @@
+// Draws the companies founded per quarter table, which the page renders
+// server side, as a bar chart in its place.
+(function () {
+    'use strict';
+
+    var SVG = 'http://www.w3.org/2000/svg';
+    var BAR_WIDTH = 24;
+    var HEIGHT = 160;
+    var LABEL_HEIGHT = 16;
+
+    function element(name, attributes) {
+        var node = document.createElementNS(SVG, name);
+        Object.keys(attributes).forEach(function (key) {
+            node.setAttribute(key, attributes[key]);
+        });
+        return node;
+    }
+
+    function drawChart(table) {
+        var rows = Array.prototype.map.call(table.tBodies[0].rows, function (row) {
+            return {label: row.cells[0].textContent, value: Number(row.cells[1].textContent)};
+        });
+        var max = Math.max.apply(null, rows.map(function (row) { return row.value; }).concat([1]));
+        var chart = element('svg', {
+            'class': 'chart',
+            'role': 'img',
+            'viewBox': '0 0 ' + rows.length * BAR_WIDTH + ' ' + (HEIGHT + LABEL_HEIGHT)
+        });
+
+        rows.forEach(function (row, i) {
+            var height = HEIGHT * row.value / max;
+            var bar = element('rect', {
+                x: i * BAR_WIDTH + 2,
+                y: HEIGHT - height,
+                width: BAR_WIDTH - 4,
+                height: height
+            });
+            var title = element('title', {});
+            title.textContent = row.label + ': ' + row.value;
+            bar.appendChild(title);
+            chart.appendChild(bar);
+
+            if (row.label.slice(-2) === 'Q1') {
+                var label = element('text', {x: i * BAR_WIDTH + 2, y: HEIGHT + LABEL_HEIGHT - 4});
+                label.textContent = row.label.slice(0, 4);
+                chart.appendChild(label);
+            }
+        });
+
+        table.hidden = true;
+        table.parentNode.insertBefore(chart, table);
+    }
+
+    document.querySelectorAll('table.chart-data').forEach(drawChart);
+}());
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import asyncio
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.db.models import Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import CompanyStatsSnapshot, CountryDealRollup, CreatorRollup, FoundingQuarterRollup
+from .queries import most_recently_founded_companies
+from .rollups import quarter_of
+
+
+def last_quarters(n, today=None):
+    """The `n` most recent (year, quarter) pairs, oldest first, ending with the current quarter."""
+    year, quarter = quarter_of(today or datetime.date.today())
+    index = year * 4 + quarter - 1
+    return [(i // 4, i % 4 + 1) for i in range(index - n + 1, index + 1)]
+
+
+def companies_founded_per_quarter(years=5, today=None):
+    """
+    Number of companies founded in each quarter of the last `years` years.
+
+    Read from `FoundingQuarterRollup`; quarters with no companies founded are
+    filled in with zero.
+    """
+    quarters = last_quarters(years * 4, today=today)
+    (first_year, _), (last_year, _) = quarters[0], quarters[-1]
+
+    rollups = (
+        FoundingQuarterRollup.objects
+        .filter(year__gte=first_year, year__lte=last_year)
+        .values_list('year', 'quarter', 'company_count')
+    )
+    founded = {(year, quarter): count for year, quarter, count in rollups}
+
+    return [
+        {'year': year, 'quarter': quarter, 'value': founded.get((year, quarter), 0)}
+        for year, quarter in quarters
+    ]
+
+
+def average_employee_count():
+    snapshot = CompanyStatsSnapshot.get()
+    if not snapshot.company_count:
+        return 0.0
+    return snapshot.employee_count / snapshot.company_count
+
+
+LEADERBOARDS = {
+    'companies': 'company_count',
+    'employees': 'employee_count',
+}
+
+
+def creator_leaderboard(by='companies', k=10):
+    """
+    The users with the top `k` company or employee totals, ties included.
+
+    A single query on the `CreatorRollup` index for `by`: everyone level
+    with the `k`-th user is returned too, so the result can be longer than
+    `k`. Ties are ordered by username.
+    """
+    field = LEADERBOARDS[by]
+    ranked = CreatorRollup.objects.filter(**{field + '__gt': 0}).order_by('-' + field)
+    # With fewer than k users ranked, everyone with a positive total makes it
+    kth = Coalesce(Subquery(ranked.values(field)[k - 1:k]), Value(1))
+    return (
+        CreatorRollup.objects
+        .filter(**{field + '__gte': kth})
+        .order_by('-' + field, 'user__username')
+        .values('user__username', 'company_count', 'employee_count')
+    )
+
+
+def top_creators(by='companies', k=10):
+    return [
+        {
+            'username': row['user__username'],
+            'company_count': row['company_count'],
+            'employee_count': row['employee_count'],
+        }
+        for row in creator_leaderboard(by, k)
+    ]
+
+
+def user_created_most_companies():
+    top = creator_leaderboard('companies', k=1).first()
+    return top['user__username'] if top else None
+
+
+def user_created_most_employees():
+    top = creator_leaderboard('employees', k=1).first()
+    return top['user__username'] if top else None
+
+
+def average_deal_amount_raised_by_country():
+    totals = (
+        CountryDealRollup.objects
+        .values('country__iso_code')
+        .annotate(deal_count=Sum('deal_count'), amount_raised_total=Sum('amount_raised_total'))
+        .filter(deal_count__gt=0)
+        .order_by('country__iso_code')
+    )
+    return [
+        {
+            'country': row['country__iso_code'],
+            'average_deal_amount_raised': row['amount_raised_total'] / row['deal_count'],
+        }
+        for row in totals
+    ]
+
+
+STATS_SECTIONS = {
+    'most_recently_founded': most_recently_founded_companies,
+    'average_employee_count': average_employee_count,
+    'companies_founded_per_quarter': companies_founded_per_quarter,
+    'user_created_most_companies': user_created_most_companies,
+    'user_created_most_employees': user_created_most_employees,
+    'average_deal_amount_raised_by_country': average_deal_amount_raised_by_country,
+}
+
+
+def _sections(fields):
+    """The `STATS_SECTIONS` named in `fields`, in their usual order; all of them if `fields` is None."""
+    if fields is None:
+        return STATS_SECTIONS
+    unknown = set(fields) - set(STATS_SECTIONS)
+    if unknown:
+        raise ValueError('Unknown stats fields: {0}'.format(', '.join(sorted(unknown))))
+    return {name: section for name, section in STATS_SECTIONS.items() if name in fields}
+
+
+def company_stats(fields=None):
+    return {name: section() for name, section in _sections(fields).items()}
+
+
+# Kept for the life of the process, unlike the executor of the event loop a
+# WSGI server starts per request, so each thread's connection is reused up
+# to CONN_MAX_AGE rather than opened afresh for every request
+_SECTION_EXECUTOR = ThreadPoolExecutor(max_workers=len(STATS_SECTIONS), thread_name_prefix='company-stats')
+
+
+def _in_transaction():
+    return connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+def _run_section(section):
+    try:
+        return section()
+    finally:
+        # Worker threads outlive the request, so their connections don't
+        # get checked by the request_finished signal
+        close_old_connections()
+
+
+async def acompany_stats(fields=None):
+    """
+    `company_stats` with its sections queried concurrently, each on its own
+    thread and connection, from a pool shared by every request.
+
+    Inside a transaction the sections run one after another on the caller's
+    connection instead, since other connections can't see its writes.
+    """
+    sections = _sections(fields)
+    if await sync_to_async(_in_transaction)():
+        run = sync_to_async(lambda section: section())
+        results = [await run(section) for section in sections.values()]
+    else:
+        run = sync_to_async(_run_section, thread_sensitive=False, executor=_SECTION_EXECUTOR)
+        results = await asyncio.gather(*(run(section) for section in sections.values()))
+    return dict(zip(sections, results))
@@ -5,6 +5,25 @@ from django.conf.urls import url
 from . import views
 
 urlpatterns = [
+    url(r'^$', views.companies_api_view, name='companies_api_view'),
+    url(r'^(?P<pk>\d+)/$', views.company_api_view, name='company_api_view'),
+    url(
+        r'^(?P<pk>\d+)/(?P<children>deals|employees)/$',
+        views.company_children_api_view,
+        name='company_children_api_view',
+    ),
     url(r'^stats/$', views.company_stats_api_view, name='company_stats_api_view'),
+    url(r'^deals/analytics/$', views.deal_analytics_api_view, name='deal_analytics_api_view'),
+    url(r'^changes/$', views.changes_api_view, name='changes_api_view'),
+    url(r'^creators/top/$', views.top_creators_api_view, name='top_creators_api_view'),
+    url(r'^monitored/$', views.monitored_companies_api_view, name='monitored_companies_api_view'),
+    url(
+        r'^export/(?P<resource>companies|deals|employees)\.(?P<output_format>ndjson|csv)$',
+        views.export_view,
+        name='export_view',
+    ),
+    url(r'^metrics/$', views.metrics_view, name='metrics_view'),
+    url(r'^search/$', views.search_companies_api_view, name='search_companies_api_view'),
+    url(r'^recent/$', views.recently_founded_companies_api_view, name='recently_founded_companies_api_view'),
     url(r'^stats/view/$', views.company_stats_view, name='company_stats_view'),
 ]
@@ -1,53 +1,419 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.http import JsonResponse
+import asyncio
+import datetime
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.dateparse import parse_date
+from django.utils.functional import SimpleLazyObject
 
+from assessment.routers import read_from_replica
+from . import details, metrics
+from .analytics import deal_analytics
+from .cache import (
+    RESPONSE_TIMEOUT, acached_json_response, bump_data_version, cached_json, cached_json_response, data_version,
+)
+from .changes import changes
+from .exports import export_rows, gzipped, render as render_export
+from .middleware import query_budget
 from .models import Company
+from .queries import founded_cursor, most_recently_founded_companies, parse_founded_cursor
+from .rollups import quarter_dates, quarter_of
+from .search import search_companies
+from .stats import LEADERBOARDS, STATS_SECTIONS, acompany_stats, company_stats, top_creators
 
 
-def most_recently_founded_companies(limit=10):
-    companies = []
-    for comp in Company.objects.all():
-        serialized = {
-            'companies_house_id': comp.companies_house_id,
-            'name': comp.name,
-            'description': comp.description,
-            'date_founded': comp.date_founded,
-            'country__iso_code': comp.country.iso_code,
-            'creator__username': comp.creator.username,
-        }
-        companies.append(serialized)
+MAX_PAGE_SIZE = 100
+MAX_MONITOR_IDS = 1000
+MAX_ANALYTICS_YEARS = 20
+
+
+def _unauthenticated():
+    return JsonResponse({'error': 'Authentication required'}, status=401)
+
+
+def _is_authenticated(request):
+    return request.user.is_authenticated
+
+
+def api_login_required(view):
+    """Like `login_required`, but answers anonymous API requests with a 401 rather than a redirect."""
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            # Loading the session and user hits the database
+            if not await sync_to_async(_is_authenticated)(request):
+                return _unauthenticated()
+            return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not _is_authenticated(request):
+            return _unauthenticated()
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def _page_size(request, default=10):
+    limit = min(int(request.GET.get('limit', default)), MAX_PAGE_SIZE)
+    if limit < 1:
+        raise ValueError(limit)
+    return limit
+
+
+def _dated(variant=None):
+    """`variant` for a cached response which also depends on today's date, e.g. through `last_quarters`."""
+    return '{0}:{1}'.format(datetime.date.today().isoformat(), variant or '')
+
+
+def _quartered(variant=None):
+    """`variant` for a cached response which covers the quarters up to the current one."""
+    return '{0}-Q{1}:{2}'.format(*quarter_of(datetime.date.today()) + (variant or '',))
+
+
+def _optional_date(request, name):
+    value = request.GET.get(name)
+    return datetime.date.fromisoformat(value) if value else None
+
 
-    if limit:
-        companies = companies[:limit]
-    return sorted(companies, key=lambda comp: comp['date_founded'])
+FLAG_VALUES = {'1': True, 'true': True, 'yes': True, 'on': True, '0': False, 'false': False, 'no': False, 'off': False}
 
 
-def company_stats_api_view(request):
+def _flag(request, name):
+    """The boolean query parameter `name`, False if absent. Raises ValueError unless it's one of `FLAG_VALUES`."""
+    value = request.GET.get(name)
+    if value is None:
+        return False
+    try:
+        return FLAG_VALUES[value.lower()]
+    except KeyError:
+        raise ValueError(value)
+
+
+@read_from_replica
+@query_budget(2)  # The second only for the page where the undated companies start
+def recently_founded_companies_api_view(request):
+    try:
+        limit = _page_size(request)
+        before = request.GET.get('before')
+        if before is not None:
+            before = parse_founded_cursor(before)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit or before cursor'}, status=400)
+
+    companies = most_recently_founded_companies(limit=limit, before=before)
     response = {
-        'most_recently_founded': most_recently_founded_companies(),
-        # NOTE: The below is dummy data so you can work on the front end without
-        # building out the API first. Replace the dummy data below once you've
-        # built functional replacements.
-        'average_employee_count': 5.0,
-        'companies_founded_per_quarter': [
-            {'year': 2017, 'quarter': 1, 'value': 5},
-            {'year': 2017, 'quarter': 2, 'value': 10},
-            {'year': 2017, 'quarter': 3, 'value': 3},
-            {'year': 2017, 'quarter': 4, 'value': 15},
-            {'year': 2018, 'quarter': 1, 'value': 24},
-        ],
-        'user_created_most_companies': 'Jeff',
-        'user_created_most_employees': 'Jane',
-        'average_deal_amount_raised_by_country': [
-            {'country': 'gb', 'average_deal_amount_raised': 500.0},
-            {'country': 'fr', 'average_deal_amount_raised': 450.0},
-        ]
+        'results': companies,
+        'next': founded_cursor(companies[-1]) if len(companies) == limit else None,
     }
     return JsonResponse(response)
 
 
+@read_from_replica
+@query_budget(6)
+async def company_stats_api_view(request):
+    """The company stats, or just the comma separated sections in ``?fields=``."""
+    fields = request.GET.get('fields')
+    if fields:
+        fields = sorted(set(fields.split(',')))
+        if not set(fields) <= set(STATS_SECTIONS):
+            return JsonResponse(
+                {'error': 'fields must be a comma separated list of {0}'.format(', '.join(STATS_SECTIONS))},
+                status=400,
+            )
+    else:
+        fields = None
+
+    return await acached_json_response(
+        request, 'company-stats', lambda: acompany_stats(fields),
+        variant=_dated(','.join(fields) if fields else None), since=datetime.date.today(),
+    )
+
+
+@read_from_replica
+@query_budget(3)
+def deal_analytics_api_view(request):
+    """
+    Distributions of the amounts raised by deals per country and per quarter
+    of the last ``?years=`` years, with rolling totals and per-company growth.
+    """
+    try:
+        years = int(request.GET.get('years', 5))
+    except ValueError:
+        years = 0
+    if not 1 <= years <= MAX_ANALYTICS_YEARS:
+        return JsonResponse({'error': 'years must be between 1 and {0}'.format(MAX_ANALYTICS_YEARS)}, status=400)
+
+    return cached_json_response(
+        request, 'deal-analytics', lambda: deal_analytics(years),
+        variant=_quartered(years), since=quarter_dates(*quarter_of(datetime.date.today()))[0],
+    )
+
+
+@read_from_replica
+@query_budget(1)
+def search_companies_api_view(request):
+    """
+    Companies matching ``?q=``, best first, optionally only those in
+    ``?country=`` or founded between ``?founded_after=`` and ``?founded_before=``.
+    """
+    try:
+        limit = _page_size(request)
+        founded_after = _optional_date(request, 'founded_after')
+        founded_before = _optional_date(request, 'founded_before')
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit, founded_after or founded_before'}, status=400)
+
+    results = search_companies(
+        request.GET.get('q', ''),
+        country=request.GET.get('country'),
+        founded_after=founded_after,
+        founded_before=founded_before,
+        limit=limit,
+    )
+    return JsonResponse({'results': results})
+
+
+@read_from_replica
+@query_budget(1)
+def top_creators_api_view(request):
+    """The users who created the most companies (``?by=companies``) or employees (``?by=employees``)."""
+    by = request.GET.get('by', 'companies')
+    try:
+        k = min(int(request.GET.get('k', 10)), MAX_PAGE_SIZE)
+    except ValueError:
+        k = 0
+    if by not in LEADERBOARDS or k < 1:
+        return JsonResponse(
+            {'error': 'by must be one of {0} and k between 1 and {1}'.format(', '.join(LEADERBOARDS), MAX_PAGE_SIZE)},
+            status=400,
+        )
+    return JsonResponse({'results': top_creators(by, k)})
+
+
+@staff_member_required
+@query_budget(6)
+def changes_api_view(request):
+    """
+    Companies, deals and employees saved or deleted after ``?since=``, in
+    the order they changed. Pass the ``next`` cursor of each page as
+    ``since`` for the following one, or to poll for later changes.
+    """
+    try:
+        limit = _page_size(request, default=MAX_PAGE_SIZE)
+        page, cursor = changes(since=request.GET.get('since'), limit=limit)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit or since cursor'}, status=400)
+    return JsonResponse({'results': page, 'next': cursor, 'more': len(page) == limit})
+
+
+def _requested_company_ids(request):
+    """
+    The ids in a JSON ``company_ids`` list (or single ``company_id``), or in
+    form ``company_id`` fields. Raises ValueError unless they're all integers.
+    """
+    if request.content_type == 'application/json':
+        data = json.loads(request.body)
+        ids = data.get('company_ids', [data['company_id']] if 'company_id' in data else [])
+        # Not a string of digits, a float or a bool, which int() would take
+        if not isinstance(ids, list) or any(type(pk) is not int for pk in ids):
+            raise ValueError(ids)
+        ids = set(ids)
+    else:
+        ids = {int(pk) for pk in request.POST.getlist('company_id')}
+    if not ids or len(ids) > MAX_MONITOR_IDS:
+        raise ValueError(ids)
+    return ids
+
+
+def monitor_companies(request):
+    try:
+        company_ids = _requested_company_ids(request)
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return JsonResponse(
+            {'error': 'Pass between 1 and {0} integer company ids'.format(MAX_MONITOR_IDS)},
+            status=400,
+        )
+
+    found = set(Company.objects.filter(pk__in=company_ids).values_list('pk', flat=True))
+    Monitor = Company.monitors.through
+    Monitor.objects.bulk_create(
+        [Monitor(company_id=pk, user_id=request.user.pk) for pk in found],
+        ignore_conflicts=True,
+    )
+    # bulk_create doesn't send m2m_changed
+    if found:
+        transaction.on_commit(bump_data_version)
+    return JsonResponse({'monitoring': sorted(found), 'not_found': sorted(company_ids - found)})
+
+
+def monitored_companies(request):
+    try:
+        limit = _page_size(request, default=MAX_PAGE_SIZE)
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit or after cursor'}, status=400)
+
+    # Walk the through table, so that the (user_id, company_id) index
+    # provides the order as well as the filter. Company.tracker's fields
+    # mustn't be deferred: FieldTracker recurses loading them on related models.
+    monitors = (
+        Company.monitors.through.objects
+        .filter(user_id=request.user.pk, company_id__gt=after)
+        .select_related('company__country')
+        .only(
+            'company__companies_house_id', 'company__name', 'company__description', 'company__date_founded',
+            'company__creator', 'company__country__iso_code',
+        )
+        .order_by('company_id')[:limit]
+    )
+    results = [
+        {
+            'id': monitor.company.pk,
+            'companies_house_id': monitor.company.companies_house_id,
+            'name': monitor.company.name,
+            'date_founded': monitor.company.date_founded,
+            'country__iso_code': monitor.company.country.iso_code,
+        }
+        for monitor in monitors
+    ]
+    response = {
+        'results': results,
+        'next': results[-1]['id'] if len(results) == limit else None,
+    }
+    return JsonResponse(response)
+
+
+@api_login_required
+@query_budget(5)  # Session, user, lookup, and bulk_create's BEGIN and INSERT
+async def monitored_companies_api_view(request):
+    """List the companies the user monitors on GET, or start monitoring the given ids on POST."""
+    # require_http_methods can't wrap async views until Django 5.0
+    if request.method == 'POST':
+        return await sync_to_async(monitor_companies)(request)
+    if request.method == 'GET':
+        return await sync_to_async(monitored_companies)(request)
+    return HttpResponseNotAllowed(['GET', 'POST'])
+
+
+def _json_list(items):
+    return b'[' + b','.join(items) + b']'
+
+
+@api_login_required
+@read_from_replica
+@query_budget(6)  # Session, user, and on a cache miss the companies, deals, employees and monitors
+def companies_api_view(request):
+    """The details of the companies with the comma separated ``?ids=``, in that order."""
+    try:
+        company_ids = list(dict.fromkeys(int(pk) for pk in request.GET['ids'].split(',')))
+    except (KeyError, ValueError):
+        company_ids = []
+    if not 1 <= len(company_ids) <= MAX_PAGE_SIZE:
+        return JsonResponse(
+            {'error': 'ids must be between 1 and {0} comma separated company ids'.format(MAX_PAGE_SIZE)},
+            status=400,
+        )
+
+    found = details.company_details(company_ids)
+    body = b'{"results":' + _json_list(found[pk] for pk in company_ids if pk in found) + \
+        b',"not_found":' + _json_list(str(pk).encode('ascii') for pk in company_ids if pk not in found) + b'}'
+    return HttpResponse(body, content_type='application/json')
+
+
+@api_login_required
+@read_from_replica
+@query_budget(6)
+def company_api_view(request, pk):
+    """A company with the first page of its deals and employees, and its monitors."""
+    body = details.company_details([int(pk)]).get(int(pk))
+    if body is None:
+        return JsonResponse({'error': 'No such company'}, status=404)
+    return HttpResponse(body, content_type='application/json')
+
+
+@api_login_required
+@read_from_replica
+@query_budget(3)
+def company_children_api_view(request, pk, children):
+    """A page of a company's deals or employees, after the ``next`` cursor ``?after=`` of the previous one."""
+    try:
+        limit = _page_size(request, default=details.CHILD_PAGE_SIZE)
+        after = request.GET.get('after')
+        if after is not None:
+            after = details.parse_child_cursor(details.CHILDREN[children], after)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit or after cursor'}, status=400)
+
+    return JsonResponse(details.child_page(int(pk), children, after=after, limit=limit))
+
+
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+@staff_member_required
+@read_from_replica
+def export_view(request, resource, output_format):
+    try:
+        since, until = _optional_date(request, 'since'), _optional_date(request, 'until')
+        compress = _flag(request, 'gzip')
+    except ValueError:
+        return JsonResponse({'error': 'since and until must be ISO dates, and gzip true or false'}, status=400)
+
+    fields, rows = export_rows(resource, since=since, until=until, country=request.GET.get('country'))
+    chunks = render_export(fields, rows, output_format)
+    filename = '{0}.{1}'.format(resource, output_format)
+    content_type = EXPORT_CONTENT_TYPES[output_format]
+    if compress:
+        chunks = gzipped(chunks)
+        filename += '.gz'
+        content_type = 'application/gzip'
+
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(filename)
+    return response
+
+
+def metrics_view(request):
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4')
+
+
+def _page_stats(variant):
+    """The company stats from `company_stats_api_view`'s cached response, with its dates parsed for the template."""
+    stats = cached_json('company-stats', company_stats, variant=variant)
+    for company in stats['most_recently_founded']:
+        company['date_founded'] = company['date_founded'] and parse_date(company['date_founded'])
+    return stats
+
+
+@read_from_replica
 def company_stats_view(request):
-    return render(request, 'companies/company_stats.html')
+    """
+    The stats page, rendered server side.
+
+    Each section is a template fragment cached under the data version and
+    today's date, so the stats are only read, from the same cached payload
+    as `company_stats_api_view`, when the data or the quarters have changed
+    since it was rendered.
+    """
+    variant = _dated()
+    return render(request, 'companies/company_stats.html', {
+        # Only loaded on a fragment cache miss
+        'stats': SimpleLazyObject(lambda: _page_stats(variant)),
+        'data_version': data_version(),
+        'stats_variant': variant,
+        'cache_alias': settings.COMPANIES_CACHE,
+        'fragment_timeout': RESPONSE_TIMEOUT,
+    })